@@ -1,8 +1,18 @@
-from fastapi import FastAPI, HTTPException
+import hmac
+import os
+from typing import Any, Dict, Optional
+from fastapi import Body, FastAPI, Header, HTTPException
 from app.models import AgentRequest, AgentResponse
-from app.services.gemini_agent import run_gemini_agent
+from app.services.gemini_agent import run_gemini_agent, response_cache, prefetcher, slot_matcher_stats
+from app.services.hedging import hedger
+from app.services.admission import admission_stats
+from app.services.history import to_turns
+from app.services.calendar_service import slot_precomputer, token_refresher
+from app.services.pipefy_service import pipefy_mirror
 from app.models import HistoryItem, HistoryPart
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from app.services.sessions import carregar_sessao, salvar_sessao
 
 app = FastAPI(title="SDR Elite Dev API")
 
@@ -18,6 +28,27 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=500)
+# ===========================
+# Ciclo de vida
+# ===========================
+
+
+@app.on_event("startup")
+def startup():
+    token_refresher.start()
+    slot_precomputer.start()
+    if pipefy_mirror is not None:
+        pipefy_mirror.start()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    token_refresher.stop()
+    slot_precomputer.stop()
+    if pipefy_mirror is not None:
+        pipefy_mirror.stop()
+
 # ===========================
 # Endpoint raiz
 # ===========================
@@ -27,14 +58,67 @@ app.add_middleware(
 def root():
     return {"message": "API SDR-Elite-Dev-IA rodando 🚀"}
 
+# ===========================
+# Métricas
+# ===========================
+
+
+@app.get("/metrics")
+def metrics():
+    return {
+        "response_cache": response_cache.stats(),
+        "admission": admission_stats(),
+        "speculation": prefetcher.stats(),
+        "hedging": hedger.stats(),
+        "pipefy_mirror": pipefy_mirror.stats() if pipefy_mirror is not None else None,
+        "slot_matcher": slot_matcher_stats.stats(),
+    }
+
+# ===========================
+# Webhook do Pipefy (espelho local de cards)
+# ===========================
+
+
+@app.post("/webhooks/pipefy")
+def pipefy_webhook(payload: Dict[str, Any] = Body(...), x_pipefy_token: Optional[str] = Header(None)):
+    # síncrono de propósito: buscar_card_remoto bloqueia no Pipefy e roda no threadpool
+    token = os.getenv("PIPEFY_WEBHOOK_TOKEN")
+    if not token:
+        raise HTTPException(
+            status_code=403, detail="Webhook desativado: defina PIPEFY_WEBHOOK_TOKEN.")
+    if not hmac.compare_digest(x_pipefy_token or "", token):
+        raise HTTPException(status_code=401, detail="Token inválido.")
+    if pipefy_mirror is None:
+        return {"status": "ignorado"}
+
+    data = payload.get("data") or {}
+    card_id = str((data.get("card") or {}).get("id") or "")
+    if not card_id.isdigit():
+        raise HTTPException(status_code=400, detail="Payload sem card válido.")
+
+    if data.get("action") == "card.delete":
+        pipefy_mirror.remover_card(card_id)
+    else:
+        pipefy_mirror.buscar_card_remoto(card_id)
+    return {"status": "ok", "card_id": card_id}
+
 # ===========================
 # Endpoint de chat
 # ===========================
 
 
-@app.post("/chat", response_model=AgentResponse)
+@app.post("/chat", response_model=AgentResponse, response_model_exclude_none=True)
 def chat(request: AgentRequest):
-    history = request.history or []
+    incremental = request.history is None and bool(
+        request.session_id and request.history_hash)
+    if incremental:
+        history = carregar_sessao(request.session_id, request.history_hash)
+        if history is None:
+            raise HTTPException(
+                status_code=409, detail="Histórico da sessão desatualizado. Reenvie o histórico completo.")
+    else:
+        history = request.history or []
+    inicio_novos = len(history)
     history.append(
         HistoryItem(
             role="user",
@@ -43,13 +127,12 @@ def chat(request: AgentRequest):
     )
 
     try:
-        history_for_agent = [
-            {"role": h.role, "parts": [{"text": p.text} for p in h.parts]}
-            for h in history
-        ]
+        # converte o histórico uma única vez, preservando partes de ferramenta
+        history_for_agent = to_turns(history)
 
         # executa o Gemini Agent
-        response = run_gemini_agent(history_for_agent)
+        response = run_gemini_agent(
+            history_for_agent, session_id=request.session_id)
 
         if hasattr(response, "tool_response") and isinstance(response.tool_response, dict):
             tr = response.tool_response
@@ -71,7 +154,12 @@ def chat(request: AgentRequest):
             )
         )
 
-        return AgentResponse(response=reply_text, history=history)
+        history_hash = salvar_sessao(
+            request.session_id, history) if request.session_id else None
+
+        if incremental:
+            return AgentResponse(response=reply_text, new_turns=history[inicio_novos:], history_hash=history_hash)
+        return AgentResponse(response=reply_text, history=history, history_hash=history_hash)
 
     except HTTPException as e:
         raise e
@@ -23,6 +23,8 @@ class AgentRequest(BaseModel):
     history: Optional[List[HistoryItem]] = Field(
         None, description="Histórico da conversa anterior.")
     session_id: Optional[str] = Field(None, alias="session_id")
+    history_hash: Optional[str] = Field(
+        None, description="Hash do histórico recebido na última resposta; substitui o envio de `history`.")
 
     class Config:
         validate_by_name = True  #
@@ -30,5 +32,9 @@ class AgentRequest(BaseModel):
 
 class AgentResponse(BaseModel):
     response: str = Field(..., description="A resposta de texto do Agente.")
-    history: List[HistoryItem] = Field(
-        ..., description="Histórico completo e atualizado da conversa.")
+    history: Optional[List[HistoryItem]] = Field(
+        None, description="Histórico completo e atualizado da conversa (omitido no modo incremental).")
+    new_turns: Optional[List[HistoryItem]] = Field(
+        None, description="Turnos adicionados nesta chamada (modo incremental).")
+    history_hash: Optional[str] = Field(
+        None, description="Hash da versão atual do histórico da sessão.")
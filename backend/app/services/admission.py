@@ -0,0 +1,121 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+# ============================
+# Controle de admissão por serviço externo
+# ============================
+# Cada serviço externo (Gemini, Calendar, Pipefy) tem um limite de chamadas
+# simultâneas e uma fila de espera limitada. Quando a fila está cheia a
+# requisição é recusada na hora (429); quando a espera passa do prazo,
+# recusada com 503. Ambas trazem Retry-After para o cliente.
+
+
+class Sobrecarga(HTTPException):
+    """Rejeição rápida por excesso de carga em um serviço externo."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(status_code=status_code, detail=detail,
+                         headers={"Retry-After": str(retry_after)})
+
+
+class AdmissionLimiter:
+    def __init__(self, nome: str, max_concorrentes: int, max_fila: int, timeout_fila: float, retry_after: int = 5):
+        self.nome = nome
+        self.max_concorrentes = max_concorrentes
+        self.max_fila = max_fila
+        self.timeout_fila = timeout_fila
+        self.retry_after = retry_after
+        self._sem = threading.BoundedSemaphore(max_concorrentes)
+        self._lock = threading.Lock()
+        self.em_uso = 0
+        self.na_fila = 0
+        self.admitidos = 0
+        self.rejeitados_fila_cheia = 0
+        self.rejeitados_timeout = 0
+
+    def _aguardar_vaga(self):
+        with self._lock:
+            if self.na_fila >= self.max_fila:
+                self.rejeitados_fila_cheia += 1
+                logger.warning(
+                    f"[ADMISSAO] {self.nome}: fila cheia ({self.na_fila}), recusando.")
+                raise Sobrecarga(
+                    429, f"Muitas requisições para {self.nome}. Tente novamente em instantes.", self.retry_after)
+            self.na_fila += 1
+        try:
+            admitido = self._sem.acquire(timeout=self.timeout_fila)
+        finally:
+            with self._lock:
+                self.na_fila -= 1
+        if not admitido:
+            with self._lock:
+                self.rejeitados_timeout += 1
+            logger.warning(
+                f"[ADMISSAO] {self.nome}: espera excedeu {self.timeout_fila}s, recusando.")
+            raise Sobrecarga(
+                503, f"O serviço {self.nome} está sobrecarregado. Tente novamente em instantes.", self.retry_after)
+
+    def adquirir(self):
+        """Ocupa uma vaga (ou recusa com Sobrecarga); par de `liberar`."""
+        if not self._sem.acquire(blocking=False):
+            self._aguardar_vaga()
+        with self._lock:
+            self.em_uso += 1
+            self.admitidos += 1
+
+    def liberar(self):
+        with self._lock:
+            self.em_uso -= 1
+        self._sem.release()
+
+    @contextmanager
+    def slot(self):
+        self.adquirir()
+        try:
+            yield
+        finally:
+            self.liberar()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_concorrentes": self.max_concorrentes,
+                "em_uso": self.em_uso,
+                "na_fila": self.na_fila,
+                "max_fila": self.max_fila,
+                "admitidos": self.admitidos,
+                "rejeitados_fila_cheia": self.rejeitados_fila_cheia,
+                "rejeitados_timeout": self.rejeitados_timeout,
+            }
+
+
+def _limiter_do_env(nome: str, prefixo: str, concorrentes: int, fila: int, timeout: float) -> AdmissionLimiter:
+    return AdmissionLimiter(
+        nome,
+        max_concorrentes=int(
+            os.getenv(f"{prefixo}_MAX_CONCORRENTES", concorrentes)),
+        max_fila=int(os.getenv(f"{prefixo}_MAX_FILA", fila)),
+        timeout_fila=float(os.getenv(f"{prefixo}_TIMEOUT_FILA", timeout)),
+        retry_after=int(os.getenv(f"{prefixo}_RETRY_AFTER", 5)),
+    )
+
+
+gemini_limiter = _limiter_do_env("Gemini", "GEMINI", 8, 16, 10)
+calendar_limiter = _limiter_do_env("Google Calendar", "CALENDAR", 8, 16, 5)
+pipefy_limiter = _limiter_do_env("Pipefy", "PIPEFY", 4, 16, 5)
+# consultas com timeout rodam em um pool do mesmo tamanho: nunca ficam na fila dele
+tools_limiter = _limiter_do_env("ferramentas", "TOOLS", 8, 16, 5)
+
+
+def admission_stats() -> dict:
+    return {
+        "gemini": gemini_limiter.stats(),
+        "calendar": calendar_limiter.stats(),
+        "pipefy": pipefy_limiter.stats(),
+        "ferramentas": tools_limiter.stats(),
+    }
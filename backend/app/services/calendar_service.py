@@ -3,13 +3,20 @@ import os
 import pickle
 import pytz
 import logging
+import threading
+import time
 from datetime import datetime, timedelta
+from typing import Optional
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from app.services.pipefy_service import atualizar_card_com_reuniao
-from app.utils.google_credentials import build_credentials_file
+from app.utils.google_credentials import load_service_account_credentials, TokenRefresher
 from app.utils.date_utils import normalizar_data
+from app.services.shared_state import shared_state
+from app.services.admission import calendar_limiter
+from app.services.tracing import medir_io
+from app.services.scheduling import SDRCalendar, SchedulingEngine, carregar_pool
 from google.oauth2.service_account import Credentials
 
 logger = logging.getLogger(__name__)
@@ -20,28 +27,38 @@ CREDENTIALS_FILE = os.getenv(
     "GOOGLE_OAUTH_CREDENTIALS", "app/credentials/credentials.json")
 TOKEN_FILE = os.getenv("GOOGLE_OAUTH_TOKEN", "app/credentials/token.pkl")
 TIMEZONE = "America/Sao_Paulo"
+# Tempo máximo (s) que um horário fica reservado enquanto é agendado
+SLOT_HOLD_TTL = int(os.getenv("SLOT_HOLD_TTL", "120"))
+# Por quanto tempo lembrar em qual agenda do pool cada evento foi criado
+EVENT_CALENDAR_TTL = 90 * 24 * 3600
 
 # key_path = os.getenv("GOOGLE_SERVICE_ACCOUNT_KEY_PATH")
 # creds = Credentials.from_service_account_file(key_path, scopes=SCOPES)
 # service = build("calendar", "v3", credentials=creds)
 
 
-def get_google_calendar_service():
-    key_content = os.environ.get("GOOGLE_SERVICE_ACCOUNT_KEY")
-    if not key_content:
-        raise ValueError(
-            "A variável de ambiente GOOGLE_SERVICE_ACCOUNT_KEY não está definida")
+def get_google_calendar_service(creds: Credentials = None):
+    creds = creds or load_service_account_credentials(SCOPES)
+    service = build("calendar", "v3", credentials=creds,
+                    cache_discovery=False)
+    return service
 
-    key_path = "/tmp/service_account.json"
-    with open(key_path, "w") as f:
-        f.write(key_content)
 
-    creds = Credentials.from_service_account_file(key_path, scopes=SCOPES)
-    service = build("calendar", "v3", credentials=creds)
-    return service
+credentials = load_service_account_credentials(SCOPES)
+token_refresher = TokenRefresher(credentials)
+service = get_google_calendar_service(credentials)
+scheduling_engine = SchedulingEngine(
+    carregar_pool(CALENDAR_ID), os.getenv("SDR_BALANCEAMENTO", "round_robin"))
 
 
-service = get_google_calendar_service()
+def _executar(request):
+    """Executa uma requisição da Calendar API respeitando o limite de concorrência."""
+    with calendar_limiter.slot():
+        with medir_io("calendar", getattr(request, "methodId", "desconhecida")) as registro:
+            resposta = request.execute()
+            if registro is not None:
+                registro["resposta"] = resposta
+            return resposta
 
 
 def _to_dt(iso_str):
@@ -53,29 +70,71 @@ def _to_dt(iso_str):
     return dt
 
 
+def _chave_reserva(start_time_iso: str, calendar_id: str) -> str:
+    return f"slot_hold:{start_time_iso}:{calendar_id}"
+
+
+def reservar_horario(start_time_iso: str, calendar_id: str, dono: str = None) -> bool:
+    """
+    Reserva o horário de uma agenda no estado compartilhado enquanto o
+    agendamento acontece, evitando que duas conversas (em workers diferentes)
+    marquem o mesmo SDR no mesmo slot. Outro SDR livre no horário continua
+    disponível.
+    """
+    return shared_state.set_if_absent(
+        _chave_reserva(start_time_iso, calendar_id), dono or "reservado", ttl=SLOT_HOLD_TTL)
+
+
+def liberar_horario(start_time_iso: str, calendar_id: str):
+    shared_state.delete(_chave_reserva(start_time_iso, calendar_id))
+
+
+def horario_reservado(start_time_iso: str) -> bool:
+    """True se todas as agendas do pool estão reservadas no horário."""
+    return all(shared_state.get(_chave_reserva(start_time_iso, c.calendar_id)) is not None
+               for c in scheduling_engine.pool)
+
+
+def reservar_sdr(start_time_iso: str, duracao_horas: int = 1, dono: str = None) -> Optional[SDRCalendar]:
+    """
+    Escolhe um SDR livre no horário e reserva esse horário na agenda dele.
+
+    Retorna None se nenhum SDR estiver livre ou todos os livres já estiverem
+    reservados. Depois de um agendamento bem-sucedido a reserva é mantida até
+    expirar (SLOT_HOLD_TTL): quem leu o free/busy antes do evento existir não
+    consegue reservar o mesmo SDR, e quem lê depois já vê o evento.
+    """
+    start = _to_dt(start_time_iso)
+    end = start + timedelta(hours=duracao_horas)
+    dia = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    ocupacao = _consultar_ocupacao(dia, dia + timedelta(days=1))
+    candidatos = scheduling_engine.livres(start, end, ocupacao)
+    while candidatos:
+        sdr = scheduling_engine.escolher(candidatos, ocupacao)
+        if reservar_horario(start_time_iso, sdr.calendar_id, dono):
+            return sdr
+        candidatos = [c for c in candidatos if c is not sdr]
+    return None
+
+
 def verificar_disponibilidade(start_time_iso: str, duracao_horas: int = 1) -> bool:
-    """Retorna True se livre no calendário para o intervalo dado."""
+    """Retorna True se algum SDR do pool estiver livre no intervalo dado."""
     start = _to_dt(start_time_iso)
     end = start + timedelta(hours=duracao_horas)
 
     try:
-        events = service.events().list(
-            calendarId=CALENDAR_ID,
-            timeMin=start.isoformat(),
-            timeMax=end.isoformat(),
-            singleEvents=True,
-            orderBy='startTime'
-        ).execute().get('items', [])
-        return len(events) == 0
+        ocupacao = _consultar_ocupacao(start, end)
+        return len(scheduling_engine.livres(start, end, ocupacao)) > 0
     except HttpError as e:
         raise Exception(f"Erro ao verificar disponibilidade: {e}")
 
 
-def agendar_evento(nome_cliente: str, email: str, start_time_str: str, duracao_horas: int = 1, card_id: str = None):
-    """Agenda evento e retorna meeting_link, meeting_datetime(iso) e eventId."""
+def agendar_evento(nome_cliente: str, email: str, start_time_str: str, duracao_horas: int = 1, card_id: str = None, sdr: SDRCalendar = None):
+    """Agenda evento (na agenda de `sdr`, se informada) e retorna meeting_link, meeting_datetime(iso) e eventId."""
     start_time_iso = normalizar_data(start_time_str)
     start = _to_dt(start_time_iso)
     end = start + timedelta(hours=duracao_horas)
+    sdr = sdr or _escolher_sdr(start, end)
 
     event = {
         'summary': f'Reunião com {nome_cliente} - Elite Dev - {card_id}',
@@ -86,15 +145,19 @@ def agendar_evento(nome_cliente: str, email: str, start_time_str: str, duracao_h
         'conferenceData': {'createRequest': {'requestId': f"meet-{int(start.timestamp())}"}}
     }
 
-    evento = service.events().insert(
-        calendarId=CALENDAR_ID,
+    evento = _executar(service.events().insert(
+        calendarId=sdr.calendar_id,
         body=event,
         conferenceDataVersion=1
-    ).execute()
+    ))
 
     print(evento["id"])
     print(evento["hangoutLink"])
 
+    shared_state.set(f"event_calendar:{evento['id']}",
+                     sdr.calendar_id, ttl=EVENT_CALENDAR_TTL)
+    _sinalizar_mudanca_agenda()
+
     meeting_link = None
     conference = evento.get('conferenceData', {})
 
@@ -103,49 +166,237 @@ def agendar_evento(nome_cliente: str, email: str, start_time_str: str, duracao_h
             meeting_link = ep.get('uri')
             break
 
-    return {"meeting_link": meeting_link, "meeting_datetime": start_time_iso, "event_id": evento.get('id')}
+    return {"meeting_link": meeting_link, "meeting_datetime": start_time_iso, "event_id": evento.get('id'), "calendar_id": sdr.calendar_id}
 
 
 def cancelar_evento(event_id: str):
-    """Remove evento do Google Calendar (se existir)."""
-    try:
-        service.events().delete(calendarId=CALENDAR_ID, eventId=event_id).execute()
-        return {"status": "cancelado", "event_id": event_id}
-    except HttpError as e:
-        if e.resp.status == 404:
-            return {"status": "nao_encontrado", "event_id": event_id}
-        raise
+    """Remove evento do Google Calendar (se existir), em qualquer agenda do pool."""
+    conhecido = shared_state.get(f"event_calendar:{event_id}")
+    calendarios = [conhecido] if conhecido else [
+        c.calendar_id for c in scheduling_engine.pool]
+    for calendar_id in calendarios:
+        try:
+            _executar(service.events().delete(
+                calendarId=calendar_id, eventId=event_id))
+            shared_state.delete(f"event_calendar:{event_id}")
+            _sinalizar_mudanca_agenda()
+            return {"status": "cancelado", "event_id": event_id}
+        except HttpError as e:
+            if e.resp.status != 404:
+                raise
+    return {"status": "nao_encontrado", "event_id": event_id}
+
+
+def _consultar_ocupacao(inicio, fim) -> dict:
+    """Intervalos ocupados de cada agenda do pool, em uma única consulta free/busy."""
+    return scheduling_engine.consultar_ocupacao(service, _executar, inicio, fim)
+
+
+def _escolher_sdr(start, end) -> SDRCalendar:
+    """Escolhe a agenda que recebe a reunião segundo a política de balanceamento."""
+    if len(scheduling_engine.pool) == 1:
+        return scheduling_engine.pool[0]
+    dia = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    ocupacao = _consultar_ocupacao(dia, dia + timedelta(days=1))
+    candidatos = scheduling_engine.livres(start, end, ocupacao)
+    if not candidatos:
+        logger.warning(
+            "Nenhum SDR livre em %s; usando a primeira agenda do pool.", start.isoformat())
+        return scheduling_engine.pool[0]
+    return scheduling_engine.escolher(candidatos, ocupacao)
+
+
+def _calcular_slots_livres(agora, tz, dias: int, inicio_hora: int, fim_hora: int, duracao_horas: int, ocupacao: dict, apenas_dias_uteis: bool = False) -> list:
+    """Lista os slots livres (datetimes) a partir de `agora`, sem novas chamadas à API."""
+    livres = []
+    for dia in range(dias):
+        data = (agora + timedelta(days=dia)).date()
+        if apenas_dias_uteis and data.weekday() >= 5:
+            continue
+        for hora in range(inicio_hora, fim_hora):
+            slot = tz.localize(datetime(data.year, data.month, data.day, hora))
+            if slot <= agora:
+                continue
+            fim_slot = slot + timedelta(hours=duracao_horas)
+            if not scheduling_engine.livres(slot, fim_slot, ocupacao):
+                continue
+            livres.append(slot)
+    return livres
+
+
+def _formatar_slots(horarios: list) -> list:
+    return [{"label": h.strftime("%d/%m/%Y %H:%M"), "iso": h.isoformat()} for h in horarios]
+
 
+def buscar_horarios_disponiveis(dias: int = 7, qtd: int = 3, inicio_hora: int = 9, fim_hora: int = 18, duracao_horas: int = 1, fuso_horario: str = TIMEZONE, contar_oferta: bool = True):
+    """`contar_oferta=False` em buscas especulativas; quem usar o resultado chama registrar_oferta."""
+    if slot_precomputer.atende(inicio_hora, fim_hora, duracao_horas, fuso_horario):
+        return slot_precomputer.ofertar(qtd, dias, contar_oferta)
 
-def buscar_horarios_disponiveis(dias: int = 7, qtd: int = 3, inicio_hora: int = 9, fim_hora: int = 18, duracao_horas: int = 1, fuso_horario: str = TIMEZONE):
     tz = pytz.timezone(fuso_horario)
     agora = datetime.now(tz).replace(minute=0, second=0, microsecond=0)
     fim = agora + timedelta(days=dias)
 
-    events_result = service.events().list(
-        calendarId=CALENDAR_ID,
-        timeMin=agora.isoformat(),
-        timeMax=fim.isoformat(),
-        singleEvents=True,
-        orderBy='startTime'
-    ).execute()
-
-    eventos = events_result.get('items', [])
-    horarios = []
-    for dia in range(dias):
-        dia_atual = (agora + timedelta(days=dia)).replace(hour=inicio_hora)
-        for hora in range(inicio_hora, fim_hora):
-            slot = dia_atual.replace(hour=hora, minute=0)
-            start_iso = slot.isoformat()
-            if verificar_disponibilidade(start_iso, duracao_horas):
-                horarios.append(slot)
-            if len(horarios) >= qtd:
-                break
-        if len(horarios) >= qtd:
-            break
-
-    horarios = sorted(horarios)[:qtd]
-    return [{"label": h.strftime("%d/%m/%Y %H:%M"), "iso": h.isoformat()} for h in horarios]
+    horarios = _calcular_slots_livres(
+        datetime.now(tz), tz, dias, inicio_hora, fim_hora, duracao_horas, _consultar_ocupacao(agora, fim))
+    slots = _formatar_slots(sorted(horarios)[:qtd])
+    if contar_oferta:
+        registrar_oferta(slots)
+    return slots
+
+
+# ============================
+# Pré-cálculo de horários livres
+# ============================
+# Mantém em memória a tabela de slots livres dos próximos dias úteis para que
+# `oferecer_horarios` responda sem ir ao Google Calendar. A tabela é refeita
+# periodicamente e sempre que a agenda muda (agendamento/cancelamento em
+# qualquer worker, sinalizado pela versão no estado compartilhado).
+SLOT_PRECOMPUTE_ENABLED = os.getenv(
+    "SLOT_PRECOMPUTE_ENABLED", "true").lower() == "true"
+SLOT_PRECOMPUTE_DIAS_UTEIS = int(os.getenv("SLOT_PRECOMPUTE_DIAS_UTEIS", "5"))
+SLOT_PRECOMPUTE_INTERVALO = int(os.getenv("SLOT_PRECOMPUTE_INTERVALO", "300"))
+# Distribui as ofertas entre conversas paralelas para evitar disputa pelo mesmo slot
+SLOT_SPREAD_ENABLED = os.getenv("SLOT_SPREAD_ENABLED", "false").lower() == "true"
+SLOT_OFFER_TTL = int(os.getenv("SLOT_OFFER_TTL", "900"))
+AGENDA_VERSION_KEY = "calendar:agenda_version"
+
+
+def registrar_oferta(slots: list):
+    """Conta os slots como oferecidos a uma conversa, para o espalhamento entre conversas."""
+    if not SLOT_SPREAD_ENABLED or not isinstance(slots, list):
+        return
+    for slot in slots:
+        shared_state.incr(f"slot_offers:{slot['iso']}", ttl=SLOT_OFFER_TTL)
+
+
+def _sinalizar_mudanca_agenda():
+    """Avisa todos os workers que a agenda mudou e a tabela de slots deve ser refeita."""
+    shared_state.incr(AGENDA_VERSION_KEY)
+    slot_precomputer.invalidar()
+
+
+class SlotPrecomputer:
+    def __init__(self, dias_uteis: int, intervalo: int, inicio_hora: int = 9, fim_hora: int = 18, duracao_horas: int = 1):
+        self.dias_uteis = dias_uteis
+        self.intervalo = intervalo
+        self.inicio_hora = inicio_hora
+        self.fim_hora = fim_hora
+        self.duracao_horas = duracao_horas
+        self.ativo = False
+        self._slots: list = []
+        self._atualizado_em = 0.0
+        self._versao = None
+        self._carregada = False
+        self._lock = threading.Lock()
+        # uma atualização por vez, seja da thread de fundo ou da primeira oferta
+        self._atualizando = threading.Lock()
+        self._acordar = threading.Event()
+        self._parar = threading.Event()
+        self._thread = None
+
+    def atende(self, inicio_hora: int, fim_hora: int, duracao_horas: int, fuso_horario: str) -> bool:
+        return self.ativo and (inicio_hora, fim_hora, duracao_horas, fuso_horario) == (
+            self.inicio_hora, self.fim_hora, self.duracao_horas, TIMEZONE)
+
+    def _janela_em_dias(self, agora) -> int:
+        # dias corridos necessários para cobrir `dias_uteis` dias úteis
+        dias, uteis = 0, 0
+        while uteis < self.dias_uteis:
+            if (agora + timedelta(days=dias)).weekday() < 5:
+                uteis += 1
+            dias += 1
+        return dias
+
+    def atualizar(self):
+        with self._atualizando:
+            self._atualizar()
+
+    def _atualizar(self):
+        versao = shared_state.get(AGENDA_VERSION_KEY)
+        tz = pytz.timezone(TIMEZONE)
+        agora = datetime.now(tz)
+        dias = self._janela_em_dias(agora)
+        inicio = agora.replace(hour=0, minute=0, second=0, microsecond=0)
+        ocupacao = _consultar_ocupacao(inicio, inicio + timedelta(days=dias))
+        slots = _calcular_slots_livres(
+            agora, tz, dias, self.inicio_hora, self.fim_hora, self.duracao_horas,
+            ocupacao, apenas_dias_uteis=True)
+        with self._lock:
+            self._slots = slots
+            self._atualizado_em = time.monotonic()
+            self._versao = versao
+            self._carregada = True
+        logger.info("[SLOTS] Tabela de horários atualizada: %d slots livres.", len(slots))
+
+    def invalidar(self):
+        with self._lock:
+            self._atualizado_em = 0.0
+        self._acordar.set()
+
+    def _desatualizado(self) -> bool:
+        with self._lock:
+            idade = time.monotonic() - self._atualizado_em
+            versao = self._versao
+        return idade > self.intervalo or versao != shared_state.get(AGENDA_VERSION_KEY)
+
+    def _garantir_tabela(self):
+        # só espera a agenda quando ainda não há tabela; fora isso serve a atual
+        # e acorda a thread de fundo. Um horário recém-ocupado ainda pode sair
+        # na oferta, mas o agendamento confere a disponibilidade de novo.
+        if not self._carregada:
+            with self._atualizando:
+                if not self._carregada:
+                    self._atualizar()
+        elif self._desatualizado():
+            self._acordar.set()
+
+    def ofertar(self, qtd: int = 3, dias: int = 7, contar_oferta: bool = True) -> list:
+        self._garantir_tabela()
+        agora = datetime.now(pytz.timezone(TIMEZONE))
+        limite = agora + timedelta(days=dias)
+        with self._lock:
+            candidatos = [s for s in self._slots if agora < s <= limite]
+        candidatos = [s for s in candidatos
+                      if not horario_reservado(s.strftime('%Y-%m-%dT%H:%M:%S'))]
+
+        if not SLOT_SPREAD_ENABLED:
+            return _formatar_slots(candidatos[:qtd])
+
+        janela = candidatos[:qtd * 3]
+        ofertas = {s: shared_state.get(f"slot_offers:{s.isoformat()}") or 0 for s in janela}
+        escolhidos = _formatar_slots(
+            sorted(sorted(janela, key=lambda s: ofertas[s])[:qtd]))
+        if contar_oferta:
+            registrar_oferta(escolhidos)
+        return escolhidos
+
+    def _loop(self):
+        while not self._parar.is_set():
+            try:
+                if self._desatualizado():
+                    self.atualizar()
+            except Exception as e:
+                logger.warning("[SLOTS] Falha ao atualizar tabela de horários: %s", e)
+            self._acordar.wait(timeout=min(self.intervalo, 30))
+            self._acordar.clear()
+
+    def start(self):
+        if not SLOT_PRECOMPUTE_ENABLED or self._thread is not None:
+            return
+        self.ativo = True
+        self._thread = threading.Thread(
+            target=self._loop, name="slot-precomputer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._parar.set()
+        self._acordar.set()
+        self.ativo = False
+
+
+slot_precomputer = SlotPrecomputer(
+    SLOT_PRECOMPUTE_DIAS_UTEIS, SLOT_PRECOMPUTE_INTERVALO)
 
 
 def tentar_agendar_ou_sugerir(
@@ -163,9 +414,14 @@ def tentar_agendar_ou_sugerir(
 
     proposed_iso_norm = normalizar_data(proposed_iso)
 
-    if verificar_disponibilidade(proposed_iso_norm, duracao_horas):
-        ag = agendar_evento(nome_cliente, email,
-                            proposed_iso_norm, duracao_horas)
+    sdr = reservar_sdr(proposed_iso_norm, duracao_horas, email)
+    if sdr is not None:
+        try:
+            ag = agendar_evento(nome_cliente, email,
+                                proposed_iso_norm, duracao_horas, sdr=sdr)
+        except Exception:
+            liberar_horario(proposed_iso_norm, sdr.calendar_id)
+            raise
 
         existente = buscar_card_por_email(email)
         if existente:
@@ -211,10 +467,30 @@ def agendar_e_atualizar_pipefy(card_id: str, nome_cliente: str, email: str, star
     from app.services.calendar_service import cancelar_evento, agendar_evento
     from app.services.pipefy_service import buscar_event_id_do_card, atualizar_card_com_reuniao
 
+    start_time_iso = normalizar_data(start_time_str)
+
+    # leitura do card antes de qualquer escrita: se o Pipefy recusar por
+    # sobrecarga (429/503), nada foi agendado e o cliente pode tentar de novo
     antigo_event_id = buscar_event_id_do_card(card_id)
     print(f"[DEBUG] antigo_event_id: {antigo_event_id}")
 
-    if antigo_event_id:
+    # escolhe e reserva o SDR antes de tocar no evento antigo: se o horário
+    # não puder ser marcado, a reunião atual do lead continua valendo
+    sdr = reservar_sdr(start_time_iso, duracao_horas, email)
+    if sdr is None:
+        return {"status": "ocupado",
+                "mensagem": f"O horário {start_time_iso} não está mais disponível."}
+    try:
+        agendamento = agendar_evento(
+            nome_cliente, email, start_time_str, duracao_horas, sdr=sdr)
+    except Exception:
+        liberar_horario(start_time_iso, sdr.calendar_id)
+        raise
+    print(f"[INFO] Novo evento agendado: {agendamento}")
+
+    # daqui em diante a reunião já existe: falhas (inclusive sobrecarga)
+    # viram aviso no resultado em vez de erro para o cliente
+    if antigo_event_id and antigo_event_id != agendamento["event_id"]:
         try:
             cancelar_evento(antigo_event_id)
             print(f"[INFO] Evento antigo {antigo_event_id} cancelado")
@@ -222,10 +498,6 @@ def agendar_e_atualizar_pipefy(card_id: str, nome_cliente: str, email: str, star
             print(
                 f"[WARNING] Falha ao cancelar evento antigo ({antigo_event_id}): {e}")
 
-    agendamento = agendar_evento(
-        nome_cliente, email, start_time_str, duracao_horas)
-    print(f"[INFO] Novo evento agendado: {agendamento}")
-
     try:
         resultado_pipefy = atualizar_card_com_reuniao(
             card_id, agendamento["meeting_link"], agendamento["meeting_datetime"], agendamento["event_id"]
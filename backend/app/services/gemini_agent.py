@@ -1,4 +1,6 @@
+import hashlib
 import logging
+import os
 import time
 import pytz
 from datetime import datetime
@@ -9,7 +11,36 @@ from google.genai import types
 from google.genai.errors import APIError
 
 from .pipefy_service import registrar_lead, atualizar_card_com_reuniao
-from .calendar_service import oferecer_horarios, agendar_reuniao
+from .calendar_service import oferecer_horarios, agendar_reuniao, registrar_oferta
+from .response_cache import ResponseCache, chave_do_historico
+from .shared_state import SHARED_STATE_BACKEND, shared_state
+from .admission import Sobrecarga, gemini_limiter
+from .history import Turn, to_turns, to_contents
+from .speculation import SpeculativePrefetcher
+from .hedging import HEDGE_ENABLED, hedger
+from .tracing import (
+    registrar_caminho,
+    registrar_ferramenta,
+    registrar_modelo,
+    registrar_sessao,
+    trace_recorder,
+)
+from .slot_matcher import SlotMatcherStats, resolver_escolha
+from .sessions import (
+    carregar_lead,
+    carregar_slots_ofertados,
+    limpar_slots_ofertados,
+    salvar_lead,
+    salvar_slots_ofertados,
+)
+from .tool_registry import (
+    AgendarReuniaoArgs,
+    AtualizarCardArgs,
+    OferecerHorariosArgs,
+    RegistrarLeadArgs,
+    ToolArgsError,
+    ToolRegistry,
+)
 
 # ============================
 # Configuração do Logger
@@ -31,12 +62,31 @@ except Exception as e:
 # ============================
 # Ferramentas disponíveis
 # ============================
-AVAILABLE_TOOLS = {
-    "registrar_lead": registrar_lead,
-    "atualizar_card_com_reuniao": atualizar_card_com_reuniao,
-    "oferecer_horarios": oferecer_horarios,
-    "agendar_reuniao": agendar_reuniao,
-}
+# Declarações, validação e timeouts montados uma única vez na inicialização.
+# Só consultas têm timeout; ferramentas que escrevem no Calendar/Pipefy rodam
+# até o fim para que o cliente nunca receba "falhou" de algo que aconteceu.
+tool_registry = ToolRegistry()
+tool_registry.register(
+    "registrar_lead", registrar_lead, RegistrarLeadArgs,
+    "Registra o lead no Pipefy (ou atualiza o card se o e-mail já existir).", timeout=None)
+tool_registry.register(
+    "atualizar_card_com_reuniao", atualizar_card_com_reuniao, AtualizarCardArgs,
+    "Atualiza o card do lead no Pipefy com link, data e event_id da reunião.", timeout=None)
+tool_registry.register(
+    "oferecer_horarios", oferecer_horarios, OferecerHorariosArgs,
+    "Lista os próximos horários livres para reunião com o time comercial.", timeout=15)
+tool_registry.register(
+    "agendar_reuniao", agendar_reuniao, AgendarReuniaoArgs,
+    "Agenda a reunião no horário escolhido pelo cliente e atualiza o card no Pipefy.", timeout=None)
+
+# Busca antecipada de horários enquanto o modelo pensa
+# (a oferta só conta para o espalhamento de slots se o resultado for usado)
+prefetcher = SpeculativePrefetcher(
+    "oferecer_horarios", oferecer_horarios,
+    timeout=tool_registry.spec("oferecer_horarios").timeout,
+    kwargs_especulativos={"contar_oferta": False},
+    ao_aproveitar=registrar_oferta,
+)
 
 # ============================
 # Instrução do Sistema do Agente SDR
@@ -122,38 +172,206 @@ Você pode me dizer seu nome completo, por favor?
 """
 
 # ============================
-# Funções auxiliares
+# Respostas por template (ferramentas determinísticas)
 # ============================
+# Ferramentas cujo resultado é estruturado o bastante para virar texto
+# localmente, sem uma segunda chamada ao modelo. Para desligar o template
+# de uma ferramenta, liste o nome em GEMINI_TEMPLATE_DESATIVADO (separado
+# por vírgula) e o fluxo volta a pedir a resposta ao Gemini.
+TEMPLATE_DESATIVADO = {
+    nome.strip() for nome in os.getenv("GEMINI_TEMPLATE_DESATIVADO", "").split(",") if nome.strip()
+}
+
+
+def _formatar_data_hora(iso_str: str) -> str:
+    dt = datetime.fromisoformat(iso_str)
+    return dt.strftime("%d/%m/%Y às %H:%M")
+
+
+def _juntar_opcoes(opcoes: List[str]) -> str:
+    if len(opcoes) == 1:
+        return opcoes[0]
+    return f"{', '.join(opcoes[:-1])} e {opcoes[-1]}"
+
 
+def _template_oferecer_horarios(result: Any) -> str | None:
+    if not isinstance(result, list):
+        return None
+    if not result:
+        return (
+            "No momento não encontrei horários livres nos próximos dias. "
+            "Você tem alguma data ou horário de preferência para eu verificar?"
+        )
+    opcoes = [_formatar_data_hora(h["iso"]) for h in result]
+    return (
+        f"Temos os seguintes horários disponíveis: {_juntar_opcoes(opcoes)} "
+        "(horário de São Paulo). Qual deles é mais conveniente para você?"
+    )
 
-def prepare_history_for_gemini(history: list[dict]) -> list[dict]:
-    prepared = []
-    for item in history:
-        role = item.get("role", "user")
-        if role not in ("user", "model"):
-            role = "model"
 
-        parts = []
-        for part in item.get("parts", []):
-            if "text" in part and part["text"]:
-                parts.append({"text": part["text"]})
-            elif "functionCall" in part:
-                parts.append({"functionCall": part["functionCall"]})
-            elif "functionResponse" in part:
-                parts.append({"functionResponse": part["functionResponse"]})
-        prepared.append({"role": role, "parts": parts})
-    return prepared
+def _template_agendar_reuniao(result: Any) -> str | None:
+    if not isinstance(result, dict) or not result.get("meeting_link"):
+        return None
+    return (
+        f"Perfeito! Reunião agendada para {_formatar_data_hora(result['meeting_datetime'])} "
+        "(horário de São Paulo).\n"
+        f"Link da reunião: {result['meeting_link']}"
+    )
+
+
+RESPONSE_TEMPLATES = {
+    "oferecer_horarios": _template_oferecer_horarios,
+    "agendar_reuniao": _template_agendar_reuniao,
+}
+
+
+def formatar_resposta_template(tool_name: str, result: Any) -> str | None:
+    """Retorna o texto da resposta montado localmente, ou None para usar o Gemini."""
+    template = RESPONSE_TEMPLATES.get(tool_name)
+    if template is None or tool_name in TEMPLATE_DESATIVADO:
+        return None
+    try:
+        return template(result)
+    except (KeyError, TypeError, ValueError) as e:
+        logger.warning(
+            f"[TEMPLATE] Falha ao formatar resposta de {tool_name}: {e}")
+        return None
+
+
+def _resposta_sintetica(texto: str) -> types.GenerateContentResponse:
+    """Monta um turno do modelo equivalente ao que o Gemini devolveria."""
+    return types.GenerateContentResponse(
+        candidates=[
+            types.Candidate(
+                content=types.Content(
+                    role="model", parts=[types.Part(text=texto)]),
+                finish_reason=types.FinishReason.STOP,
+            )
+        ]
+    )
 
 
 # ============================
 # Execução principal
 # ============================
-MAX_RETRIES = 3
 PRIMARY_MODEL = "gemini-2.5-flash"
 FALLBACK_MODEL = "gemini-2.0-flash"
 
+# ============================
+# Cache de respostas (turnos iniciais / FAQ)
+# ============================
+# A versão do prompt entra na chave: qualquer mudança na instrução do
+# sistema ou no modelo invalida as respostas já cacheadas.
+PROMPT_VERSION = hashlib.sha256(
+    f"{PRIMARY_MODEL}:{SDR_SYSTEM_INSTRUCTION}".encode("utf-8")).hexdigest()[:12]
+# Quantas trocas iniciais são cacheáveis. Uma troca é a mensagem do cliente
+# mais a resposta do modelo; as boas-vindas fixas que o frontend envia antes da
+# primeira mensagem entram na chave, mas não contam como troca.
+RESPONSE_CACHE_MAX_TURNS = int(os.getenv("RESPONSE_CACHE_MAX_TURNS", "1"))
+
+response_cache = ResponseCache(
+    max_itens=int(os.getenv("RESPONSE_CACHE_MAX_ITEMS", "512")),
+    ttl_segundos=float(os.getenv("RESPONSE_CACHE_TTL", "600")),
+    estado=shared_state if SHARED_STATE_BACKEND != "memory" else None,
+)
+
+
+def _trocas(turns: List[Turn]) -> int:
+    """Respostas do modelo desde a primeira mensagem do cliente, mais a troca atual."""
+    primeira = next((i for i, t in enumerate(turns) if t.role == "user"), None)
+    if primeira is None:
+        return 0
+    return 1 + sum(1 for t in turns[primeira:] if t.role == "model")
+
+
+def _chave_cache(turns: List[Turn]):
+    if not turns or turns[-1].role != "user" or _trocas(turns) > RESPONSE_CACHE_MAX_TURNS:
+        return None
+    chave = chave_do_historico(turns)
+    if chave is None:
+        return None
+    return (PROMPT_VERSION, chave)
+
+
+# ============================
+# Escolha de horário resolvida localmente
+# ============================
+# Com os horários oferecidos e o lead registrado guardados na sessão, uma
+# resposta inequívoca do cliente ("15h", "a segunda") agenda direto, sem
+# passar pelo Gemini. Qualquer ambiguidade segue o caminho normal.
+SLOT_MATCHER_ENABLED = os.getenv(
+    "SLOT_MATCHER_ENABLED", "true").lower() == "true"
+slot_matcher_stats = SlotMatcherStats()
+
+
+def _atualizar_estado_sessao(session_id: str, tool_name: str, args: dict, result: Any):
+    if not session_id:
+        return
+    if tool_name == "oferecer_horarios" and isinstance(result, list) and result:
+        salvar_slots_ofertados(session_id, result)
+    elif tool_name == "registrar_lead" and isinstance(result, dict) and result.get("card_id"):
+        salvar_lead(session_id, {
+            "card_id": result["card_id"],
+            "nome_cliente": args.get("nome"),
+            "email": args.get("email"),
+        })
+    elif tool_name == "agendar_reuniao" and isinstance(result, dict) and result.get("meeting_link"):
+        limpar_slots_ofertados(session_id)
+
+
+def _agendar_escolha_local(turns: List[Turn], session_id: str) -> types.GenerateContentResponse | None:
+    # sem o template de confirmação o modelo teria de redigir a resposta
+    if not SLOT_MATCHER_ENABLED or "agendar_reuniao" in TEMPLATE_DESATIVADO:
+        return None
+    if not session_id or not turns or turns[-1].role != "user":
+        return None
+    slots = carregar_slots_ofertados(session_id)
+    lead = carregar_lead(session_id)
+    if not slots or not lead:
+        return None
+    registrar_sessao(slots, lead)
+
+    escolhido = resolver_escolha(" ".join(turns[-1].texts()), slots)
+    if escolhido is None:
+        slot_matcher_stats.registrar(acerto=False)
+        return None
+
+    try:
+        args = tool_registry.validar("agendar_reuniao", {
+            **lead, "start_time_iso": escolhido["iso"]})
+    except ToolArgsError as e:
+        logger.warning(f"[SLOT_MATCHER] Dados do lead inválidos: {e}")
+        slot_matcher_stats.registrar(acerto=False)
+        return None
+
+    logger.info(
+        f"[SLOT_MATCHER] Escolha resolvida localmente: {escolhido['iso']}")
+    inicio = time.perf_counter()
+    result = tool_registry.executar("agendar_reuniao", args)
+    registrar_ferramenta("agendar_reuniao", args, result, inicio, "slot_matcher")
+    _atualizar_estado_sessao(session_id, "agendar_reuniao", args, result)
+
+    # sem reunião criada (erro ou conflito), o modelo conduz a conversa
+    texto = formatar_resposta_template("agendar_reuniao", result)
+    if texto is None:
+        slot_matcher_stats.registrar(acerto=False)
+        return None
+    # com o template ativo o caminho normal custaria uma chamada ao modelo
+    slot_matcher_stats.registrar(acerto=True, chamadas_economizadas=1)
+    registrar_caminho("slot_matcher")
+    return _resposta_sintetica(texto)
+
+
+def run_gemini_agent(history: List[Turn] | List[Dict[str, Any]], session_id: str = None) -> types.GenerateContentResponse:
+    turns = to_turns(history)
+    with trace_recorder.turno(session_id, turns) as trace:
+        response = _executar_turno(turns, session_id)
+        if trace is not None:
+            trace.resposta = response
+        return response
+
 
-def run_gemini_agent(history: List[Dict[str, Any]]) -> types.GenerateContentResponse:
+def _executar_turno(turns: List[Turn], session_id: str = None) -> types.GenerateContentResponse:
     if client is None:
         raise Exception("Cliente Gemini não configurado.")
 
@@ -167,62 +385,73 @@ def run_gemini_agent(history: List[Dict[str, Any]]) -> types.GenerateContentResp
         Não mencione que o link da reunião foi enviado pelo Gmail.
         {SDR_SYSTEM_INSTRUCTION}
     """
-    history = prepare_history_for_gemini(history)
-    gemini_contents: List[types.Content] = []
-
-    for item in history:
-        role = item["role"]
-        parts_data = item["parts"]
-        gemini_parts: List[types.Part] = []
-
-        for part in parts_data:
-            if "text" in part:
-                gemini_parts.append(types.Part(text=part["text"]))
-            elif "functionCall" in part:
-                fc = part["functionCall"]
-                gemini_parts.append(types.Part.from_function_call(
-                    types.FunctionCall(name=fc["name"], args=fc["args"])
-                ))
-            elif "functionResponse" in part:
-                fr = part["functionResponse"]
-                gemini_parts.append(types.Part.from_function_response(
-                    name=fr["name"], response=fr["response"]
-                ))
-        gemini_contents.append(types.Content(role=role, parts=gemini_parts))
+
+    chave_cache = _chave_cache(turns)
+    if chave_cache is not None:
+        texto_cacheado = response_cache.get(chave_cache)
+        if texto_cacheado is not None:
+            logger.info("[CACHE] Resposta servida do cache.")
+            registrar_caminho("cache")
+            return _resposta_sintetica(texto_cacheado)
+
+    resposta_local = _agendar_escolha_local(turns, session_id)
+    if resposta_local is not None:
+        return resposta_local
+
+    gemini_contents: List[types.Content] = to_contents(turns)
+
+    def _gerar(model, contents):
+        with gemini_limiter.slot():
+            return client.models.generate_content(
+                model=model,
+                contents=contents,
+                config=types.GenerateContentConfig(
+                    system_instruction=system_instruction_with_date,
+                    tools=[tool_registry.tool],
+                ),
+            )
+
+    def _gerar_primario(contents):
+        if not HEDGE_ENABLED:
+            return _gerar(PRIMARY_MODEL, contents)
+        return hedger.executar(
+            lambda: _gerar(PRIMARY_MODEL, contents),
+            lambda: _gerar(FALLBACK_MODEL, contents),
+        )
 
     def _call_gemini_with_retry(contents):
-        for attempt in range(MAX_RETRIES):
-            try:
-                return client.models.generate_content(
-                    model=PRIMARY_MODEL,
-                    contents=contents,
-                    config=types.GenerateContentConfig(
-                        system_instruction=system_instruction_with_date,
-                        tools=list(AVAILABLE_TOOLS.values()),
-                    ),
-                )
-            except APIError as e:
-                if "503" in str(e) or "UNAVAILABLE" in str(e):
-                    wait = 40
-                    logger.warning(
-                        f"[WARN] Gemini sobrecarregado. Tentativa {attempt+1}/{MAX_RETRIES} — aguardando {wait:.1f}s...")
-                    time.sleep(wait)
-                elif "NOT_FOUND" in str(e):
-                    logger.warning(
-                        f"[WARN] Modelo {PRIMARY_MODEL} indisponível. Alternando para {FALLBACK_MODEL}.")
-                    return client.models.generate_content(
-                        model=FALLBACK_MODEL,
-                        contents=contents,
-                        config=types.GenerateContentConfig(
-                            system_instruction=system_instruction_with_date,
-                            tools=list(AVAILABLE_TOOLS.values()),
-                        ),
-                    )
-                else:
-                    raise
-        raise HTTPException(
-            status_code=503, detail="O modelo está temporariamente indisponível. Tente novamente em alguns segundos.")
+        inicio = time.perf_counter()
+        response = _tentar_gemini(contents)
+        registrar_modelo(inicio, response)
+        return response
 
+    def _sobrecarregado(e: APIError) -> bool:
+        return "503" in str(e) or "UNAVAILABLE" in str(e)
+
+    def _tentar_gemini(contents):
+        # sem esperas na thread da requisição: com o Gemini sobrecarregado,
+        # tenta o fallback uma vez e devolve 503 com Retry-After ao cliente
+        try:
+            return _gerar_primario(contents)
+        except APIError as e:
+            if "NOT_FOUND" in str(e):
+                logger.warning(
+                    f"[WARN] Modelo {PRIMARY_MODEL} indisponível. Alternando para {FALLBACK_MODEL}.")
+                return _gerar(FALLBACK_MODEL, contents)
+            if not _sobrecarregado(e):
+                raise
+        logger.warning(
+            f"[WARN] {PRIMARY_MODEL} sobrecarregado. Tentando {FALLBACK_MODEL} uma vez.")
+        try:
+            return _gerar(FALLBACK_MODEL, contents)
+        except APIError as e:
+            if not _sobrecarregado(e):
+                raise
+        raise Sobrecarga(
+            503, "O modelo está temporariamente indisponível. Tente novamente em alguns segundos.",
+            retry_after=gemini_limiter.retry_after)
+
+    especulacao = prefetcher.iniciar(turns)
     try:
         response = _call_gemini_with_retry(gemini_contents)
 
@@ -233,9 +462,28 @@ def run_gemini_agent(history: List[Dict[str, Any]]) -> types.GenerateContentResp
 
             logger.info(f"[GEMINI] Chamando ferramenta: {tool_name}({args})")
 
-            if tool_name in AVAILABLE_TOOLS:
-                tool_func = AVAILABLE_TOOLS[tool_name]
-                result = tool_func(**args)
+            if tool_name in tool_registry:
+                inicio = time.perf_counter()
+                try:
+                    args = tool_registry.validar(tool_name, args)
+                except ToolArgsError as e:
+                    logger.warning(f"[GEMINI] Chamada rejeitada: {e}")
+                    result, origem = e.resultado(), "invalida"
+                else:
+                    result = prefetcher.resolver(especulacao, tool_name, args)
+                    especulacao, origem = None, "especulacao"
+                    if result is None:
+                        result = tool_registry.executar(tool_name, args)
+                        origem = "executada"
+                    _atualizar_estado_sessao(
+                        session_id, tool_name, args, result)
+                registrar_ferramenta(tool_name, args, result, inicio, origem)
+
+                texto_template = formatar_resposta_template(tool_name, result)
+                if texto_template is not None:
+                    logger.info(
+                        f"[GEMINI] Resposta de {tool_name} montada por template.")
+                    return _resposta_sintetica(texto_template)
 
                 response = _call_gemini_with_retry([
                     *gemini_contents,
@@ -252,9 +500,15 @@ def run_gemini_agent(history: List[Dict[str, Any]]) -> types.GenerateContentResp
                 ])
             else:
                 raise Exception(f"Ferramenta desconhecida: {tool_name}")
+        elif chave_cache is not None and response.text:
+            response_cache.set(chave_cache, response.text)
 
         return response
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erro no Gemini Agent: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        prefetcher.descartar(especulacao)
@@ -0,0 +1,158 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# ============================
+# Requisições "hedged" (primário + fallback)
+# ============================
+# Se o modelo primário não responder dentro do percentil configurado da sua
+# latência recente, uma segunda chamada vai para o modelo de fallback; a
+# primeira resposta válida vence e a outra é descartada. Um teto limita a
+# fração de requisições que podem gerar hedge, para não dobrar o custo.
+# O pool tem uma thread por vaga e nada espera na fila dele: sem vaga para o
+# primário, a chamada roda na thread da requisição sem hedge; sem vaga para o
+# fallback, o hedge é pulado.
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTIL = float(os.getenv("HEDGE_PERCENTIL", "95"))
+HEDGE_DELAY_INICIAL = float(os.getenv("HEDGE_DELAY_INICIAL", "8"))
+HEDGE_DELAY_MIN = float(os.getenv("HEDGE_DELAY_MIN", "2"))
+HEDGE_MAX_TAXA = float(os.getenv("HEDGE_MAX_TAXA", "0.1"))
+
+_JANELA = 200
+_AMOSTRAS_MINIMAS = 20
+
+
+class Hedger:
+    def __init__(self, percentil: float, delay_inicial: float, delay_min: float, max_taxa: float, max_workers: int = 16):
+        self.percentil = percentil
+        self.delay_inicial = delay_inicial
+        self.delay_min = delay_min
+        self.max_taxa = max_taxa
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hedge")
+        self._vagas = threading.BoundedSemaphore(max_workers)
+        self._lock = threading.Lock()
+        self._latencias = deque(maxlen=_JANELA)
+        self._hedges_recentes = deque(maxlen=_JANELA)
+        self.requisicoes = 0
+        self.hedges = 0
+        self.vitorias_hedge = 0
+        self.vitorias_primario = 0
+        self.bloqueados_por_orcamento = 0
+        self.sem_vaga = 0
+
+    def delay_atual(self) -> float:
+        with self._lock:
+            amostras = sorted(self._latencias)
+        if len(amostras) < _AMOSTRAS_MINIMAS:
+            return self.delay_inicial
+        idx = min(int(len(amostras) * self.percentil / 100), len(amostras) - 1)
+        return max(amostras[idx], self.delay_min)
+
+    def _orcamento_permite(self) -> bool:
+        with self._lock:
+            if not self._hedges_recentes:
+                return self.max_taxa > 0
+            taxa = (sum(self._hedges_recentes) + 1) / (len(self._hedges_recentes) + 1)
+            return taxa <= self.max_taxa
+
+    def _cronometrado(self, fn: Callable[[], Any]) -> Callable[[], Any]:
+        # mede a partir do início da chamada, não do envio ao pool
+        def _executar():
+            inicio = time.monotonic()
+            resultado = fn()
+            with self._lock:
+                self._latencias.append(time.monotonic() - inicio)
+            return resultado
+        return _executar
+
+    def _submeter(self, fn: Callable[[], Any]) -> Optional[Future]:
+        """Envia ao pool só se houver thread livre; None em vez de enfileirar."""
+        if not self._vagas.acquire(blocking=False):
+            with self._lock:
+                self.sem_vaga += 1
+            return None
+        try:
+            future = self._executor.submit(fn)
+        except BaseException:
+            self._vagas.release()
+            raise
+        future.add_done_callback(lambda _: self._vagas.release())
+        return future
+
+    def executar(self, primario: Callable[[], Any], fallback: Callable[[], Any]) -> Any:
+        with self._lock:
+            self.requisicoes += 1
+
+        f_primario = self._submeter(self._cronometrado(primario))
+        if f_primario is None:
+            with self._lock:
+                self._hedges_recentes.append(0)
+            resultado = self._cronometrado(primario)()
+            with self._lock:
+                self.vitorias_primario += 1
+            return resultado
+
+        done, _ = wait([f_primario], timeout=self.delay_atual())
+        f_fallback = None
+        if not done:
+            if self._orcamento_permite():
+                f_fallback = self._submeter(fallback)
+            else:
+                with self._lock:
+                    self.bloqueados_por_orcamento += 1
+        if f_fallback is None:
+            with self._lock:
+                self._hedges_recentes.append(0)
+            resultado = f_primario.result()
+            with self._lock:
+                self.vitorias_primario += 1
+            return resultado
+
+        logger.info("[HEDGE] Primário lento; disparando chamada ao modelo de fallback.")
+        with self._lock:
+            self.hedges += 1
+            self._hedges_recentes.append(1)
+
+        pendentes = {f_primario, f_fallback}
+        ultimo_erro = None
+        while pendentes:
+            done, pendentes = wait(pendentes, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is not None:
+                    ultimo_erro = f.exception()
+                    continue
+                for outro in pendentes:
+                    outro.cancel()
+                with self._lock:
+                    if f is f_fallback:
+                        self.vitorias_hedge += 1
+                    else:
+                        self.vitorias_primario += 1
+                return f.result()
+        raise ultimo_erro
+
+    def stats(self) -> dict:
+        delay = self.delay_atual()
+        with self._lock:
+            return {
+                "ativo": HEDGE_ENABLED,
+                "requisicoes": self.requisicoes,
+                "hedges": self.hedges,
+                "taxa_hedge": round(self.hedges / self.requisicoes, 4) if self.requisicoes else 0.0,
+                "vitorias_hedge": self.vitorias_hedge,
+                "vitorias_primario": self.vitorias_primario,
+                "bloqueados_por_orcamento": self.bloqueados_por_orcamento,
+                "sem_vaga": self.sem_vaga,
+                "delay_atual_s": round(delay, 3),
+            }
+
+
+hedger = Hedger(HEDGE_PERCENTIL, HEDGE_DELAY_INICIAL,
+                HEDGE_DELAY_MIN, HEDGE_MAX_TAXA)
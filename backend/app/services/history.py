@@ -0,0 +1,137 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Iterable, List, Tuple
+
+from google.genai import types
+
+# ============================
+# Representação compacta do histórico
+# ============================
+# O histórico chega uma vez do request (HistoryItem) e vira uma lista de
+# Turn. Cada Turn guarda as partes como tuplas (tipo, valor), preservando
+# chamadas e respostas de ferramenta, e é convertido para types.Content uma
+# única vez: turnos idênticos já vistos reaproveitam o Content memoizado.
+
+TEXT = "text"
+FUNCTION_CALL = "function_call"
+FUNCTION_RESPONSE = "function_response"
+
+# Respostas de ferramenta (function/tool) são enviadas ao Gemini como "user";
+# qualquer outro papel desconhecido vira "model".
+_PAPEIS = {"user": "user", "model": "model", "function": "user", "tool": "user"}
+
+_CONTENT_CACHE_MAX = 4096
+_content_cache: "OrderedDict[Tuple, types.Content]" = OrderedDict()
+_content_lock = threading.Lock()
+
+
+class Turn:
+    __slots__ = ("role", "parts", "_key")
+
+    def __init__(self, role: str, parts: Tuple[Tuple[str, Any], ...]):
+        self.role = _PAPEIS.get(role, "model")
+        self.parts = parts
+        self._key = None
+
+    # ---------- parsing ----------
+    @classmethod
+    def from_history_item(cls, item) -> "Turn":
+        parts = []
+        for p in item.parts:
+            if p.text:
+                parts.append((TEXT, p.text))
+            elif p.function_call:
+                parts.append((FUNCTION_CALL, p.function_call))
+            elif p.function_response:
+                parts.append((FUNCTION_RESPONSE, p.function_response))
+        return cls(item.role, tuple(parts))
+
+    @classmethod
+    def from_dict(cls, item: dict) -> "Turn":
+        parts = []
+        for p in item.get("parts", []):
+            if p.get("text"):
+                parts.append((TEXT, p["text"]))
+            elif p.get("functionCall") or p.get("function_call"):
+                parts.append(
+                    (FUNCTION_CALL, p.get("functionCall") or p.get("function_call")))
+            elif p.get("functionResponse") or p.get("function_response"):
+                parts.append(
+                    (FUNCTION_RESPONSE, p.get("functionResponse") or p.get("function_response")))
+        return cls(item.get("role", "user"), tuple(parts))
+
+    @classmethod
+    def text(cls, role: str, texto: str) -> "Turn":
+        return cls(role, ((TEXT, texto),))
+
+    # ---------- conversão ----------
+    @property
+    def key(self) -> Tuple:
+        if self._key is None:
+            self._key = (self.role, tuple(
+                (tipo, valor if tipo == TEXT else json.dumps(
+                    valor, sort_keys=True, default=str))
+                for tipo, valor in self.parts
+            ))
+        return self._key
+
+    def has_function_parts(self) -> bool:
+        return any(tipo != TEXT for tipo, _ in self.parts)
+
+    def texts(self) -> List[str]:
+        return [valor for tipo, valor in self.parts if tipo == TEXT]
+
+    def to_dict(self) -> dict:
+        chaves = {TEXT: "text", FUNCTION_CALL: "functionCall",
+                  FUNCTION_RESPONSE: "functionResponse"}
+        return {"role": self.role, "parts": [{chaves[tipo]: valor} for tipo, valor in self.parts]}
+
+    def _build_content(self) -> types.Content:
+        gemini_parts: List[types.Part] = []
+        for tipo, valor in self.parts:
+            if tipo == TEXT:
+                gemini_parts.append(types.Part(text=valor))
+            elif tipo == FUNCTION_CALL:
+                gemini_parts.append(types.Part.from_function_call(
+                    name=valor["name"], args=valor.get("args") or {}))
+            else:
+                gemini_parts.append(types.Part.from_function_response(
+                    name=valor["name"], response=valor.get("response") or {}))
+        return types.Content(role=self.role, parts=gemini_parts)
+
+    def to_content(self) -> types.Content:
+        chave = self.key
+        with _content_lock:
+            content = _content_cache.get(chave)
+            if content is not None:
+                _content_cache.move_to_end(chave)
+                return content
+        content = self._build_content()
+        with _content_lock:
+            _content_cache[chave] = content
+            if len(_content_cache) > _CONTENT_CACHE_MAX:
+                _content_cache.popitem(last=False)
+        return content
+
+
+def to_turns(history: Iterable) -> List[Turn]:
+    """Aceita Turn, HistoryItem ou dicts e devolve uma lista de Turn."""
+    turns = []
+    for item in history:
+        if isinstance(item, Turn):
+            turns.append(item)
+        elif isinstance(item, dict):
+            turns.append(Turn.from_dict(item))
+        else:
+            turns.append(Turn.from_history_item(item))
+    return turns
+
+
+def to_contents(turns: Iterable[Turn]) -> List[types.Content]:
+    return [t.to_content() for t in turns if t.parts]
+
+
+def clear_content_cache() -> None:
+    with _content_lock:
+        _content_cache.clear()
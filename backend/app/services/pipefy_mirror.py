@@ -0,0 +1,268 @@
+import logging
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from app.services.shared_state import shared_state
+
+logger = logging.getLogger(__name__)
+
+# ============================
+# Espelho local do pipe de pré-vendas
+# ============================
+# Guarda cards e valores de campos em SQLite para que as leituras do
+# pipefy_service (busca por e-mail, event_id do card) não precisem de rede.
+# É mantido por polling incremental em `updated_at` e, opcionalmente, pelo
+# webhook POST /webhooks/pipefy. Escritas feitas por este backend são
+# aplicadas no espelho logo após o sucesso no Pipefy (read-your-writes).
+# A cada PIPEFY_MIRROR_RECONCILIAR segundos a sincronização lista o pipe
+# inteiro e remove os cards que não existem mais (exclusões sem webhook).
+PIPEFY_MIRROR_PATH = os.getenv("PIPEFY_MIRROR_PATH", "/tmp/pipefy_mirror.db")
+PIPEFY_MIRROR_INTERVALO = int(os.getenv("PIPEFY_MIRROR_INTERVALO", "60"))
+PIPEFY_MIRROR_RECONCILIAR = int(os.getenv("PIPEFY_MIRROR_RECONCILIAR", "3600"))
+
+CARD_FIELDS_FRAGMENT = """
+    id
+    title
+    updated_at
+    fields {
+      name
+      value
+    }
+"""
+
+
+def _agora_iso() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _instante(iso: str) -> datetime:
+    dt = datetime.fromisoformat(iso.replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+class PipefyMirror:
+    def __init__(self, path: str, executar_query, pipe_id: str):
+        self.path = path
+        self._executar_query = executar_query
+        self.pipe_id = pipe_id
+        self._local = threading.local()
+        self._parar = threading.Event()
+        self._thread = None
+        with self._conexao() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS cards (
+                    id TEXT PRIMARY KEY,
+                    title TEXT,
+                    updated_at TEXT,
+                    email TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_cards_email ON cards (email);
+                CREATE TABLE IF NOT EXISTS card_fields (
+                    card_id TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    value TEXT,
+                    PRIMARY KEY (card_id, name)
+                );
+                CREATE TABLE IF NOT EXISTS meta (
+                    chave TEXT PRIMARY KEY,
+                    valor TEXT
+                );
+            """)
+
+    def _conexao(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    # ---------- meta ----------
+    def _get_meta(self, chave: str) -> str | None:
+        row = self._conexao().execute(
+            "SELECT valor FROM meta WHERE chave = ?", (chave,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, conn, chave: str, valor: str):
+        conn.execute(
+            "INSERT OR REPLACE INTO meta (chave, valor) VALUES (?, ?)", (chave, valor))
+
+    @property
+    def pronto(self) -> bool:
+        """True depois da primeira sincronização completa."""
+        return self._get_meta("ultima_sincronizacao") is not None
+
+    # ---------- escrita ----------
+    def salvar_card(self, node: dict):
+        """Insere/atualiza um card no formato retornado pela API (id, title, fields)."""
+        conn = self._conexao()
+        with conn:
+            self._salvar(conn, node)
+
+    def _salvar(self, conn, node: dict):
+        email = None
+        conn.execute("DELETE FROM card_fields WHERE card_id = ?", (node["id"],))
+        for field in node.get("fields", []):
+            nome = (field.get("name") or "").strip()
+            valor = field.get("value")
+            if nome.lower() == "email" and valor:
+                email = valor.strip().lower()
+            conn.execute(
+                "INSERT OR REPLACE INTO card_fields (card_id, name, value) VALUES (?, ?, ?)",
+                (node["id"], nome, valor))
+        conn.execute(
+            "INSERT OR REPLACE INTO cards (id, title, updated_at, email) VALUES (?, ?, ?, ?)",
+            (node["id"], node.get("title"), node.get("updated_at") or _agora_iso(), email))
+
+    def atualizar_campos(self, card_id: str, valores: dict, title: str = None):
+        """Aplica localmente campos recém-gravados no Pipefy (read-your-writes)."""
+        card = self.buscar_card(card_id) or {
+            "id": card_id, "title": title, "fields": []}
+        campos = {f["name"]: f["value"] for f in card["fields"]}
+        campos.update({nome: valor for nome, valor in valores.items() if valor is not None})
+        card["fields"] = [{"name": n, "value": v} for n, v in campos.items()]
+        card["updated_at"] = _agora_iso()
+        self.salvar_card(card)
+
+    def remover_card(self, card_id: str):
+        conn = self._conexao()
+        with conn:
+            conn.execute("DELETE FROM card_fields WHERE card_id = ?", (card_id,))
+            conn.execute("DELETE FROM cards WHERE id = ?", (card_id,))
+
+    # ---------- leitura ----------
+    def buscar_card(self, card_id: str) -> dict | None:
+        conn = self._conexao()
+        row = conn.execute(
+            "SELECT id, title, updated_at FROM cards WHERE id = ?", (str(card_id),)).fetchone()
+        if row is None:
+            return None
+        fields = conn.execute(
+            "SELECT name, value FROM card_fields WHERE card_id = ?", (row[0],)).fetchall()
+        return {"id": row[0], "title": row[1], "updated_at": row[2],
+                "fields": [{"name": n, "value": v} for n, v in fields]}
+
+    def buscar_por_email(self, email: str) -> dict | None:
+        row = self._conexao().execute(
+            "SELECT id FROM cards WHERE email = ? ORDER BY updated_at DESC LIMIT 1",
+            (email.strip().lower(),)).fetchone()
+        return self.buscar_card(row[0]) if row else None
+
+    def contar_cards(self) -> int:
+        return self._conexao().execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+
+    # ---------- sincronização ----------
+    def buscar_card_remoto(self, card_id: str) -> dict | None:
+        """Busca um card na API e o grava no espelho."""
+        query = f"""
+        query {{
+          card(id: "{card_id}") {{
+            {CARD_FIELDS_FRAGMENT}
+          }}
+        }}
+        """
+        card = self._executar_query(query).get("data", {}).get("card")
+        if card:
+            self.salvar_card(card)
+        return card
+
+    def _reconciliacao_vencida(self) -> bool:
+        ultima = self._get_meta("ultima_reconciliacao")
+        return ultima is None or (
+            datetime.now(timezone.utc) - _instante(ultima)).total_seconds() >= PIPEFY_MIRROR_RECONCILIAR
+
+    def sincronizar(self, completo: bool = False) -> int:
+        """
+        Sincroniza cards alterados desde o maior `updated_at` já recebido do
+        Pipefy. Com `completo=True` (e na primeira vez) lista o pipe inteiro e
+        remove do espelho os cards que não vieram na listagem.
+        """
+        cursor = self._get_meta("cursor_updated_at")
+        desde = None if completo else cursor
+        filtro = f', filter: {{field: "updated_at", operator: gte, value: "{desde}"}}' if desde else ""
+        after = None
+        total = 0
+        conn = self._conexao()
+        # cards gravados durante a listagem (webhook, escrita local) não entram
+        # aqui e portanto nunca são removidos por engano
+        existentes = {r[0] for r in conn.execute("SELECT id FROM cards")} if desde is None else set()
+        vistos = set()
+        while True:
+            after_clause = f', after: "{after}"' if after else ""
+            query = f"""
+            query {{
+              allCards(pipeId: {self.pipe_id}, first: 50{after_clause}{filtro}) {{
+                pageInfo {{
+                  hasNextPage
+                  endCursor
+                }}
+                edges {{
+                  node {{
+                    {CARD_FIELDS_FRAGMENT}
+                  }}
+                }}
+              }}
+            }}
+            """
+            result = self._executar_query(query)
+            if result.get("error") or "errors" in result:
+                raise Exception(
+                    f"Falha ao sincronizar espelho do Pipefy: {result.get('error') or result.get('errors')}")
+            all_cards = result.get("data", {}).get("allCards", {})
+            with conn:
+                for edge in all_cards.get("edges", []):
+                    node = edge["node"]
+                    self._salvar(conn, node)
+                    vistos.add(str(node["id"]))
+                    total += 1
+                    # cursor pelo relógio do Pipefy, não pelo local
+                    atualizado = node.get("updated_at")
+                    if atualizado and (cursor is None or _instante(atualizado) > _instante(cursor)):
+                        cursor = atualizado
+            page_info = all_cards.get("pageInfo", {})
+            if not page_info.get("hasNextPage"):
+                break
+            after = page_info.get("endCursor")
+
+        removidos = existentes - vistos
+        with conn:
+            for card_id in removidos:
+                conn.execute("DELETE FROM card_fields WHERE card_id = ?", (card_id,))
+                conn.execute("DELETE FROM cards WHERE id = ?", (card_id,))
+            if cursor is not None:
+                self._set_meta(conn, "cursor_updated_at", cursor)
+            self._set_meta(conn, "ultima_sincronizacao", _agora_iso())
+            if desde is None:
+                self._set_meta(conn, "ultima_reconciliacao", _agora_iso())
+        logger.info("[PIPEFY] Espelho sincronizado: %d cards alterados, %d removidos.",
+                    total, len(removidos))
+        return total
+
+    def _loop(self):
+        while not self._parar.is_set():
+            # com vários workers, só um sincroniza por intervalo
+            if shared_state.set_if_absent("pipefy_mirror:poll", os.getpid(), ttl=PIPEFY_MIRROR_INTERVALO):
+                try:
+                    self.sincronizar(completo=self._reconciliacao_vencida())
+                except Exception as e:
+                    logger.warning("[PIPEFY] Falha ao sincronizar espelho: %s", e)
+            self._parar.wait(PIPEFY_MIRROR_INTERVALO)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._loop, name="pipefy-mirror", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._parar.set()
+
+    def stats(self) -> dict:
+        return {
+            "cards": self.contar_cards(),
+            "ultima_sincronizacao": self._get_meta("ultima_sincronizacao"),
+            "ultima_reconciliacao": self._get_meta("ultima_reconciliacao"),
+        }
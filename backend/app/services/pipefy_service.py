@@ -4,6 +4,10 @@ import json
 import logging
 from dotenv import load_dotenv
 from app.utils.date_utils import normalizar_data
+from app.services.shared_state import shared_state
+from app.services.admission import pipefy_limiter
+from app.services.tracing import medir_io, operacao_graphql
+from app.services.pipefy_mirror import PipefyMirror, PIPEFY_MIRROR_PATH
 
 load_dotenv()
 
@@ -16,12 +20,25 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-# Cache para os IDs dos campos
+# Cache para os IDs dos campos (cópia local do valor no estado compartilhado)
 _field_id_cache = {}
+FIELD_IDS_KEY = f"pipefy:field_ids:{PIPE_ID}"
 
 # Modo simulação
 SIMULATION_MODE = not ACCESS_TOKEN or "SIMULACAO" in ACCESS_TOKEN.upper()
 
+# Rótulos dos campos do Start Form -> chaves internas
+FIELD_LABELS = {
+    "Nome": "nome",
+    "Email": "email",
+    "Empresa": "empresa",
+    "Necessidade": "necessidade",
+    "Interesse_confirmado": "interesse",
+    "Meeting_link": "link_reuniao",
+    "Data Reuniao": "data_reuniao",
+    "event_id": "event_id"
+}
+
 
 def _executar_query(query: str, variables: dict = None) -> dict:
     """Executa uma query/mutation GraphQL no Pipefy."""
@@ -32,18 +49,21 @@ def _executar_query(query: str, variables: dict = None) -> dict:
     }
     payload = {"query": query, "variables": variables or {}}
 
-    try:
-        response = requests.post(
-            PIPEFY_URL, headers=headers, json=payload, timeout=10)
-        response.raise_for_status()
-        result = response.json()
-        if "errors" in result:
-            logger.error("Pipefy retornou erros: %s",
-                         json.dumps(result["errors"], indent=2))
+    with pipefy_limiter.slot(), medir_io("pipefy", operacao_graphql(query)) as registro:
+        try:
+            response = requests.post(
+                PIPEFY_URL, headers=headers, json=payload, timeout=10)
+            response.raise_for_status()
+            result = response.json()
+            if "errors" in result:
+                logger.error("Pipefy retornou erros: %s",
+                             json.dumps(result["errors"], indent=2))
+        except Exception as e:
+            logger.error("Erro ao conectar com Pipefy: %s", e)
+            result = {"error": str(e)}
+        if registro is not None:
+            registro["resposta"] = result
         return result
-    except Exception as e:
-        logger.error("Erro ao conectar com Pipefy: %s", e)
-        return {"error": str(e)}
 
 
 def _get_field_ids() -> dict:
@@ -52,6 +72,11 @@ def _get_field_ids() -> dict:
     if _field_id_cache:
         return _field_id_cache
 
+    compartilhado = shared_state.get(FIELD_IDS_KEY)
+    if compartilhado:
+        _field_id_cache = compartilhado
+        return _field_id_cache
+
     query = """
     query GetPipeFields($pipeId: ID!) {
       pipe(id: $pipeId) {
@@ -74,16 +99,7 @@ def _get_field_ids() -> dict:
     if not fields:
         raise Exception("Nenhum campo encontrado no Start Form do Pipe.")
 
-    label_map = {
-        "Nome": "nome",
-        "Email": "email",
-        "Empresa": "empresa",
-        "Necessidade": "necessidade",
-        "Interesse_confirmado": "interesse",
-        "Meeting_link": "link_reuniao",
-        "Data Reuniao": "data_reuniao",
-        "event_id": "event_id"
-    }
+    label_map = FIELD_LABELS
     for field in fields:
         if field.get("label") in label_map:
             _field_id_cache[label_map[field["label"]]] = field.get("id")
@@ -92,11 +108,37 @@ def _get_field_ids() -> dict:
         logger.warning("Nem todos os campos esperados foram encontrados no Pipefy: %s", list(
             _field_id_cache.keys()))
 
+    shared_state.set(FIELD_IDS_KEY, _field_id_cache)
     return _field_id_cache
 
 
+# Espelho local dos cards (None em modo simulação ou se desativado)
+PIPEFY_MIRROR_ENABLED = os.getenv(
+    "PIPEFY_MIRROR_ENABLED", "true").lower() == "true"
+pipefy_mirror = PipefyMirror(PIPEFY_MIRROR_PATH, _executar_query, PIPE_ID) if (
+    PIPEFY_MIRROR_ENABLED and not SIMULATION_MODE) else None
+
+
+def _espelhar_campos(card_id: str, valores: dict, title: str = None):
+    """Aplica no espelho os campos gravados (chaves internas -> rótulos do Pipefy)."""
+    if pipefy_mirror is None:
+        return
+    por_label = {label: valores[chave]
+                 for label, chave in FIELD_LABELS.items() if chave in valores}
+    try:
+        pipefy_mirror.atualizar_campos(card_id, por_label, title=title)
+    except Exception as e:
+        logger.warning("Falha ao atualizar espelho do card %s: %s", card_id, e)
+
+
 def buscar_card_por_email(email: str, after_cursor: str = None) -> dict | None:
     """Busca um card existente no Pipefy pelo e-mail."""
+    if pipefy_mirror is not None and after_cursor is None and pipefy_mirror.pronto:
+        card = pipefy_mirror.buscar_por_email(email)
+        logger.info("Busca por e-mail %s no espelho local: %s",
+                    email, card["id"] if card else "nenhum card")
+        return card
+
     after_clause = f', after: "{after_cursor}"' if after_cursor else ""
     query = f"""
         query {{
@@ -210,6 +252,11 @@ def registrar_lead(nome: str, email: str, empresa: str, necessidade: str, dateti
 
     card_data = result.get("data", {}).get("createCard", {}).get("card")
     if card_data:
+        _espelhar_campos(card_data["id"], {
+            "nome": nome, "email": email, "empresa": empresa,
+            "necessidade": necessidade_value, "interesse": "Sim",
+            "link_reuniao": link_reuniao, "data_reuniao": datetime_str, "event_id": event_id,
+        }, title=card_data.get("title"))
         return {"status": "criado", "card_id": card_data["id"], "mensagem": "Lead registrado com sucesso."}
     return {"status": "falha", "mensagem": "Falha ao criar card.", "detalhes": result}
 
@@ -243,7 +290,14 @@ def buscar_event_id_do_card(card_id: str) -> str | None:
     Retorna o event_id do Google Calendar salvo no Pipefy, se existir.
     Procura pelo campo 'event_id'.
     """
-    from app.services.pipefy_service import _executar_query
+    if pipefy_mirror is not None:
+        card = pipefy_mirror.buscar_card(card_id) or pipefy_mirror.buscar_card_remoto(card_id)
+        if not card:
+            return None
+        for f in card.get("fields", []):
+            if f.get("name", "").strip().lower() == "event_id":
+                return f.get("value")
+        return None
 
     # Monta query para buscar o card pelo ID
     query = f"""
@@ -293,13 +347,17 @@ def atualizar_card_com_reuniao(card_id: str = None, link: str = None, datetime_s
         return {"status": "erro", "mensagem": str(e)}
 
     values = []
+    gravados = {}
     if link and "link_reuniao" in field_ids:
         values.append({"fieldId": field_ids["link_reuniao"], "value": link})
+        gravados["link_reuniao"] = link
     if datetime_str and "data_reuniao" in field_ids:
+        gravados["data_reuniao"] = normalizar_data(datetime_str)
         values.append(
-            {"fieldId": field_ids["data_reuniao"], "value": normalizar_data(datetime_str)})
+            {"fieldId": field_ids["data_reuniao"], "value": gravados["data_reuniao"]})
     if event_id and "event_id" in field_ids:  # ✅ Adicionado event_id
         values.append({"fieldId": field_ids["event_id"], "value": event_id})
+        gravados["event_id"] = event_id
 
     if not values:
         return {"status": "nada_para_atualizar", "mensagem": "Nenhum campo informado para atualização."}
@@ -316,4 +374,6 @@ def atualizar_card_com_reuniao(card_id: str = None, link: str = None, datetime_s
 
     success = result.get("data", {}).get(
         "updateFieldsValues", {}).get("success")
+    if success:
+        _espelhar_campos(card_id, gravados)
     return {"status": "sucesso" if success else "falha", "card_id": card_id, "detalhes": result}
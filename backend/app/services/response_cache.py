@@ -0,0 +1,119 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+from app.services.history import Turn
+from app.services.shared_state import SharedState
+
+
+# ============================
+# Normalização de prompts
+# ============================
+def normalizar_prompt(texto: str) -> str:
+    """Remove acentos, pontuação e espaços extras para comparar prompts."""
+    texto = unicodedata.normalize("NFKD", texto or "")
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^\w\s]", " ", texto.lower())
+    return " ".join(texto.split())
+
+
+def chave_do_historico(turns: List[Turn]) -> Optional[Tuple]:
+    """
+    Gera a chave de cache para um histórico só de texto.
+    Retorna None se algum turno tiver chamada/resposta de ferramenta.
+    """
+    chave = []
+    for turn in turns:
+        if turn.has_function_parts():
+            return None
+        chave.append((turn.role, " ".join(
+            normalizar_prompt(t) for t in turn.texts())))
+    return tuple(chave)
+
+
+# ============================
+# Cache LRU com TTL
+# ============================
+class ResponseCache:
+    """
+    Cache LRU com expiração por TTL e contadores de acerto.
+    Se `estado` for informado, ele funciona como segundo nível compartilhado
+    entre workers; o LRU local continua evitando idas ao backend.
+    """
+
+    def __init__(self, max_itens: int = 512, ttl_segundos: float = 600, estado: SharedState = None):
+        self.max_itens = max_itens
+        self.ttl_segundos = ttl_segundos
+        self.estado = estado
+        self._itens: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _chave_compartilhada(chave) -> str:
+        digest = hashlib.sha256(json.dumps(
+            chave, ensure_ascii=False).encode("utf-8")).hexdigest()
+        return f"resp:{digest}"
+
+    def _get_local(self, chave) -> Optional[Any]:
+        item = self._itens.get(chave)
+        if item is None:
+            return None
+        expira_em, valor = item
+        if expira_em < time.monotonic():
+            del self._itens[chave]
+            self.evictions += 1
+            return None
+        self._itens.move_to_end(chave)
+        return valor
+
+    def _set_local(self, chave, valor) -> None:
+        self._itens[chave] = (time.monotonic() + self.ttl_segundos, valor)
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.max_itens:
+            self._itens.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, chave) -> Optional[Any]:
+        with self._lock:
+            valor = self._get_local(chave)
+        if valor is None and self.estado is not None:
+            valor = self.estado.get(self._chave_compartilhada(chave))
+            if valor is not None:
+                with self._lock:
+                    self._set_local(chave, valor)
+        with self._lock:
+            if valor is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return valor
+
+    def set(self, chave, valor) -> None:
+        with self._lock:
+            self._set_local(chave, valor)
+        if self.estado is not None:
+            self.estado.set(self._chave_compartilhada(chave),
+                            valor, ttl=self.ttl_segundos)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._itens.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "itens": len(self._itens),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,118 @@
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from app.services.shared_state import shared_state
+
+logger = logging.getLogger(__name__)
+
+# ============================
+# Pool de agendas de SDR
+# ============================
+# SDR_CALENDARS lista as agendas do time, cada uma com seu expediente:
+#   SDR_CALENDARS="ana@empresa.com|9-18,bruno@empresa.com|13-20"
+# Sem horário, a agenda aceita qualquer hora (a janela de oferta continua
+# sendo a de buscar_horarios_disponiveis). Sem a variável, o pool tem
+# apenas GOOGLE_CALENDAR_ID.
+# SDR_BALANCEAMENTO escolhe a política: round_robin ou least_loaded.
+
+Intervalo = Tuple[datetime, datetime]
+
+
+class SDRCalendar:
+    __slots__ = ("calendar_id", "inicio_hora", "fim_hora")
+
+    def __init__(self, calendar_id: str, inicio_hora: int = 0, fim_hora: int = 24):
+        self.calendar_id = calendar_id
+        self.inicio_hora = inicio_hora
+        self.fim_hora = fim_hora
+
+    def no_expediente(self, inicio: datetime, fim: datetime) -> bool:
+        fim_expediente = inicio.replace(
+            hour=0, minute=0, second=0, microsecond=0) + timedelta(hours=self.fim_hora)
+        return inicio.hour >= self.inicio_hora and fim <= fim_expediente
+
+    def __repr__(self):
+        return f"SDRCalendar({self.calendar_id!r}, {self.inicio_hora}-{self.fim_hora})"
+
+
+def carregar_pool(padrao_calendar_id: str) -> List[SDRCalendar]:
+    bruto = os.getenv("SDR_CALENDARS", "").strip()
+    if not bruto:
+        return [SDRCalendar(padrao_calendar_id)]
+    pool = []
+    for item in bruto.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        calendar_id, _, horario = item.partition("|")
+        if horario:
+            inicio, _, fim = horario.partition("-")
+            pool.append(SDRCalendar(calendar_id.strip(), int(inicio), int(fim)))
+        else:
+            pool.append(SDRCalendar(calendar_id.strip()))
+    return pool
+
+
+class SchedulingEngine:
+    """Consulta free/busy de todas as agendas de uma vez e distribui reuniões entre SDRs."""
+
+    def __init__(self, pool: List[SDRCalendar], politica: str = "round_robin"):
+        if politica not in ("round_robin", "least_loaded"):
+            logger.warning(
+                "SDR_BALANCEAMENTO desconhecido (%s); usando round_robin.", politica)
+            politica = "round_robin"
+        self.pool = pool
+        self.politica = politica
+
+    def consultar_ocupacao(self, service, executar, inicio: datetime, fim: datetime) -> Dict[str, List[Intervalo]]:
+        """Uma única chamada freebusy para todas as agendas do pool."""
+        resposta = executar(service.freebusy().query(body={
+            "timeMin": inicio.isoformat(),
+            "timeMax": fim.isoformat(),
+            "items": [{"id": c.calendar_id} for c in self.pool],
+        }))
+        ocupacao = {}
+        com_erro = []
+        for c in self.pool:
+            dados = resposta.get("calendars", {}).get(c.calendar_id)
+            if dados is None or dados.get("errors"):
+                # agenda que não conseguimos ler conta como ocupada na janela toda
+                logger.warning("Erro no free/busy da agenda %s: %s",
+                               c.calendar_id, (dados or {}).get("errors", "agenda ausente na resposta"))
+                com_erro.append(c.calendar_id)
+                ocupacao[c.calendar_id] = [(inicio, fim)]
+                continue
+            ocupacao[c.calendar_id] = [
+                (datetime.fromisoformat(b["start"]), datetime.fromisoformat(b["end"]))
+                for b in dados.get("busy", [])
+            ]
+        if len(com_erro) == len(self.pool):
+            raise Exception(
+                f"Nenhuma agenda do pool pôde ser consultada: {', '.join(com_erro)}")
+        return ocupacao
+
+    def livres(self, inicio: datetime, fim: datetime, ocupacao: Dict[str, List[Intervalo]]) -> List[SDRCalendar]:
+        """SDRs com expediente e agenda livre em [inicio, fim)."""
+        return [
+            c for c in self.pool
+            if c.no_expediente(inicio, fim)
+            and not any(ini < fim and f > inicio for ini, f in ocupacao.get(c.calendar_id, []))
+        ]
+
+    def escolher(self, candidatos: List[SDRCalendar], ocupacao: Dict[str, List[Intervalo]]) -> SDRCalendar:
+        if len(candidatos) == 1:
+            return candidatos[0]
+        if self.politica == "least_loaded":
+            # free/busy funde reuniões encostadas num só intervalo: a carga é a soma das durações
+            return min(candidatos, key=lambda c: sum(
+                ((f - ini).total_seconds() for ini, f in ocupacao.get(c.calendar_id, [])), 0.0))
+        # round robin sobre a ordem do pool, pulando quem não está livre
+        vez = shared_state.incr("sdr:round_robin") - 1
+        ids = {c.calendar_id for c in candidatos}
+        for i in range(len(self.pool)):
+            sdr = self.pool[(vez + i) % len(self.pool)]
+            if sdr.calendar_id in ids:
+                return sdr
+        return candidatos[0]
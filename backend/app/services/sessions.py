@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+from typing import List, Optional
+
+from app.models import HistoryItem
+from app.services.shared_state import shared_state
+
+# ============================
+# Histórico por sessão (protocolo incremental do /chat)
+# ============================
+# O servidor guarda o histórico completo de cada session_id no estado
+# compartilhado, junto com um hash que identifica a versão. O cliente envia
+# só o prompt novo e o último hash recebido; se o hash não bater, pede-se
+# um reenvio completo (409).
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(24 * 3600)))
+
+
+def _serializar(history: List[HistoryItem]) -> list:
+    return [h.model_dump(by_alias=True, exclude_none=True) for h in history]
+
+
+def hash_historico(history_serializado: list) -> str:
+    bruto = json.dumps(history_serializado, ensure_ascii=False,
+                       sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(bruto.encode("utf-8")).hexdigest()[:16]
+
+
+def carregar_sessao(session_id: str, history_hash: str) -> Optional[List[HistoryItem]]:
+    """Retorna o histórico salvo se o hash do cliente for o atual; senão None."""
+    sessao = shared_state.get(f"session:{session_id}")
+    if not sessao or sessao.get("hash") != history_hash:
+        return None
+    return [HistoryItem.model_validate(h) for h in sessao["history"]]
+
+
+def salvar_sessao(session_id: str, history: List[HistoryItem]) -> str:
+    serializado = _serializar(history)
+    novo_hash = hash_historico(serializado)
+    shared_state.set(f"session:{session_id}",
+                     {"hash": novo_hash, "history": serializado}, ttl=SESSION_TTL)
+    return novo_hash
+
+
+# ============================
+# Estado de agendamento por sessão
+# ============================
+# Últimos horários oferecidos e dados do lead registrado, usados para
+# resolver a escolha do horário sem uma nova chamada ao modelo.
+def salvar_slots_ofertados(session_id: str, slots: list):
+    shared_state.set(f"offered_slots:{session_id}", slots, ttl=SESSION_TTL)
+
+
+def carregar_slots_ofertados(session_id: str) -> Optional[list]:
+    return shared_state.get(f"offered_slots:{session_id}")
+
+
+def limpar_slots_ofertados(session_id: str):
+    shared_state.delete(f"offered_slots:{session_id}")
+
+
+def salvar_lead(session_id: str, lead: dict):
+    shared_state.set(f"lead:{session_id}", lead, ttl=SESSION_TTL)
+
+
+def carregar_lead(session_id: str) -> Optional[dict]:
+    return shared_state.get(f"lead:{session_id}")
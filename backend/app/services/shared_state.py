@@ -0,0 +1,243 @@
+import json
+from abc import ABC, abstractmethod
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# ============================
+# Estado compartilhado entre workers
+# ============================
+# Com um único worker o estado fica em memória. Com vários workers
+# (gunicorn/uvicorn --workers N) use SHARED_STATE_BACKEND=sqlite para que
+# caches, sessões e reservas de horário sejam vistos por todos os processos.
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "memory").lower()
+SHARED_STATE_PATH = os.getenv("SHARED_STATE_PATH", "/tmp/sdr_shared_state.db")
+# Chaves expiradas só somem quando lidas; a cada intervalo uma escrita
+# aproveita para remover todas as expiradas (sessões abandonadas etc.).
+SHARED_STATE_PURGE_INTERVAL = float(
+    os.getenv("SHARED_STATE_PURGE_INTERVAL", "60"))
+
+
+class SharedState(ABC):
+    """Interface mínima de chave/valor com expiração opcional (TTL em segundos)."""
+
+    @abstractmethod
+    def get(self, chave: str) -> Optional[Any]:
+        ...
+
+    @abstractmethod
+    def set(self, chave: str, valor: Any, ttl: float = None) -> None:
+        ...
+
+    @abstractmethod
+    def set_if_absent(self, chave: str, valor: Any, ttl: float = None) -> bool:
+        """Grava só se a chave não existir (ou estiver expirada). Retorna True se gravou."""
+
+    @abstractmethod
+    def delete(self, chave: str) -> None:
+        ...
+
+    @abstractmethod
+    def incr(self, chave: str, quantidade: int = 1, ttl: float = None) -> int:
+        ...
+
+    @abstractmethod
+    def expurgar(self) -> int:
+        """Remove todas as chaves expiradas. Retorna quantas foram removidas."""
+
+    @abstractmethod
+    def limpar(self) -> None:
+        """Remove todas as chaves (testes e replay)."""
+
+    def _talvez_expurgar(self):
+        agora = time.monotonic()
+        if agora - getattr(self, "_ultimo_expurgo", 0.0) < SHARED_STATE_PURGE_INTERVAL:
+            return
+        self._ultimo_expurgo = agora
+        try:
+            removidas = self.expurgar()
+            if removidas:
+                logger.info("Estado compartilhado: %d chaves expiradas removidas.", removidas)
+        except Exception as e:
+            logger.warning("Falha ao remover chaves expiradas: %s", e)
+
+
+def _expira_em(ttl: float = None) -> Optional[float]:
+    return time.time() + ttl if ttl else None
+
+
+class MemoryState(SharedState):
+    """Estado em memória do processo — adequado para um único worker."""
+
+    def __init__(self):
+        self._dados: dict = {}
+        self._lock = threading.Lock()
+
+    def _ler(self, chave: str):
+        item = self._dados.get(chave)
+        if item is None:
+            return None
+        valor, expira_em = item
+        if expira_em is not None and expira_em < time.time():
+            del self._dados[chave]
+            return None
+        return item
+
+    def get(self, chave: str) -> Optional[Any]:
+        with self._lock:
+            item = self._ler(chave)
+            return item[0] if item else None
+
+    def set(self, chave: str, valor: Any, ttl: float = None) -> None:
+        self._talvez_expurgar()
+        with self._lock:
+            self._dados[chave] = (valor, _expira_em(ttl))
+
+    def set_if_absent(self, chave: str, valor: Any, ttl: float = None) -> bool:
+        self._talvez_expurgar()
+        with self._lock:
+            if self._ler(chave) is not None:
+                return False
+            self._dados[chave] = (valor, _expira_em(ttl))
+            return True
+
+    def delete(self, chave: str) -> None:
+        with self._lock:
+            self._dados.pop(chave, None)
+
+    def incr(self, chave: str, quantidade: int = 1, ttl: float = None) -> int:
+        self._talvez_expurgar()
+        with self._lock:
+            item = self._ler(chave)
+            if item is None:
+                item = (0, _expira_em(ttl))
+            novo = int(item[0]) + quantidade
+            self._dados[chave] = (novo, item[1])
+            return novo
+
+    def expurgar(self) -> int:
+        agora = time.time()
+        with self._lock:
+            expiradas = [c for c, (_, expira_em) in self._dados.items()
+                         if expira_em is not None and expira_em < agora]
+            for chave in expiradas:
+                del self._dados[chave]
+        return len(expiradas)
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._dados.clear()
+
+
+class SQLiteState(SharedState):
+    """Estado em arquivo SQLite (modo WAL), compartilhado entre processos da mesma máquina."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._conexao() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS estado ("
+                "chave TEXT PRIMARY KEY, valor TEXT NOT NULL, expira_em REAL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_estado_expira_em ON estado (expira_em)")
+
+    def _conexao(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transacao(self):
+        conn = self._conexao()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def get(self, chave: str) -> Optional[Any]:
+        row = self._conexao().execute(
+            "SELECT valor, expira_em FROM estado WHERE chave = ?", (chave,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def set(self, chave: str, valor: Any, ttl: float = None) -> None:
+        self._talvez_expurgar()
+        self._conexao().execute(
+            "INSERT OR REPLACE INTO estado (chave, valor, expira_em) VALUES (?, ?, ?)",
+            (chave, json.dumps(valor), _expira_em(ttl)),
+        )
+
+    def set_if_absent(self, chave: str, valor: Any, ttl: float = None) -> bool:
+        self._talvez_expurgar()
+        conn = self._transacao()
+        try:
+            conn.execute(
+                "DELETE FROM estado WHERE chave = ? AND expira_em IS NOT NULL AND expira_em < ?",
+                (chave, time.time()),
+            )
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO estado (chave, valor, expira_em) VALUES (?, ?, ?)",
+                (chave, json.dumps(valor), _expira_em(ttl)),
+            )
+            conn.execute("COMMIT")
+            return cur.rowcount == 1
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, chave: str) -> None:
+        self._conexao().execute("DELETE FROM estado WHERE chave = ?", (chave,))
+
+    def incr(self, chave: str, quantidade: int = 1, ttl: float = None) -> int:
+        self._talvez_expurgar()
+        conn = self._transacao()
+        try:
+            row = conn.execute(
+                "SELECT valor, expira_em FROM estado WHERE chave = ?", (chave,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] < time.time()):
+                atual, expira_em = 0, _expira_em(ttl)
+            else:
+                atual, expira_em = int(json.loads(row[0])), row[1]
+            novo = atual + quantidade
+            conn.execute(
+                "INSERT OR REPLACE INTO estado (chave, valor, expira_em) VALUES (?, ?, ?)",
+                (chave, json.dumps(novo), expira_em),
+            )
+            conn.execute("COMMIT")
+            return novo
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def expurgar(self) -> int:
+        cur = self._conexao().execute(
+            "DELETE FROM estado WHERE expira_em IS NOT NULL AND expira_em < ?", (time.time(),))
+        return cur.rowcount
+
+    def limpar(self) -> None:
+        self._conexao().execute("DELETE FROM estado")
+
+
+def _criar_estado() -> SharedState:
+    if SHARED_STATE_BACKEND == "sqlite":
+        logger.info("Estado compartilhado em SQLite: %s", SHARED_STATE_PATH)
+        return SQLiteState(SHARED_STATE_PATH)
+    if SHARED_STATE_BACKEND != "memory":
+        logger.warning(
+            "SHARED_STATE_BACKEND desconhecido (%s); usando memória.", SHARED_STATE_BACKEND)
+    return MemoryState()
+
+
+shared_state = _criar_estado()
@@ -0,0 +1,182 @@
+import re
+import threading
+import unicodedata
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+# ============================
+# Escolha de horário sem passar pelo modelo
+# ============================
+# Depois que os horários foram oferecidos, respostas como "15h", "a segunda
+# opção" ou "terça às 10" são mapeadas localmente para o `iso` do slot. Só
+# há match quando exatamente um slot sobra e a mensagem é curta e sem
+# negação; em qualquer dúvida a conversa segue pelo Gemini. "Segunda",
+# "quarta" e "quinta" sem "feira" ou "opção" podem ser dia ou posição e
+# por isso também vão para o modelo. A mensagem precisa ser só a escolha:
+# além de ordinal, hora, dia e data, apenas palavras de _PALAVRAS_ESCOLHA
+# ("quero", "pode ser", "fico com"...). "Só um segundo" ou "me manda o link
+# às 15h" têm outras palavras e seguem para o modelo.
+
+_MAX_PALAVRAS = 10
+_NEGACOES = {"nao", "nenhum", "nenhuma", "outro", "outra", "outros", "outras",
+             "mas", "porem", "depois", "antes", "mudar", "trocar"}
+
+_ORDINAIS = {
+    "primeira": 0, "primeiro": 0, "segunda": 1, "segundo": 1, "terceira": 2, "terceiro": 2,
+    "quarta": 3, "quarto": 3, "quinta": 4, "quinto": 4, "ultima": -1, "ultimo": -1,
+}
+# dias que também são ordinais só contam como dia da semana com "feira"
+_DIAS_SEMANA = {"segunda": 0, "terca": 1, "quarta": 2,
+                "quinta": 3, "sexta": 4, "sabado": 5, "domingo": 6}
+_DIAS_AMBIGUOS = {"segunda", "quarta", "quinta"}
+
+_PALAVRAS_ESCOLHA = {
+    "quero", "queria", "prefiro", "escolho", "fico", "com", "pode", "ser", "vou", "vamos",
+    "marcar", "agendar", "marca", "agenda", "serve", "sim", "ok", "entao", "beleza",
+    "perfeito", "otimo", "fechado", "melhor", "por", "favor",
+    "a", "o", "as", "os", "e", "na", "no", "de", "do", "da", "pra", "para",
+    "esse", "essa", "este", "esta", "dia", "feira", "opcao", "alternativa", "horario",
+    "hoje", "amanha", "h", "hs", "hora", "horas",
+}
+_RE_TOKEN_NUMERICO = re.compile(
+    r"\b\d{1,2}(?::\d{2}|/\d{1,2}|h(?:s|oras?)?(?:\d{2})?)?\b")
+
+_RE_HORA = re.compile(
+    r"\b(\d{1,2})(?::(\d{2})|\s*h(?:s|oras?)?(?:\s*(\d{2}))?)(?![\w/])")
+_RE_HORA_AS = re.compile(r"\bas\s+(\d{1,2})\b(?![:/])")
+_RE_DATA = re.compile(r"\b(\d{1,2})/(\d{1,2})\b")
+_RE_DIA = re.compile(r"\bdia\s+(\d{1,2})\b(?!/)")
+_RE_OPCAO_NUM = re.compile(r"\b(?:opcao|alternativa|horario)\s+(\d)\b|\b(\d)\s*(?:a|o)?\s+(?:opcao|alternativa)\b")
+
+
+def _normalizar(texto: str) -> str:
+    texto = unicodedata.normalize("NFKD", texto or "")
+    texto = "".join(c for c in texto if not unicodedata.combining(c)).lower()
+    texto = re.sub(r"[^\w\s:/]", " ", texto)
+    return " ".join(texto.split())
+
+
+def _extrair_dia_semana(texto: str) -> Optional[int]:
+    for nome, dia in _DIAS_SEMANA.items():
+        if re.search(rf"\b{nome}\s+feira\b", texto):
+            return dia
+        if nome not in _DIAS_AMBIGUOS and re.search(rf"\b{nome}\b", texto):
+            return dia
+    return None
+
+
+def _so_escolha(texto: str) -> bool:
+    """True se, tirando números/horas/datas, só sobram ordinais, dias e palavras de escolha."""
+    resto = _RE_TOKEN_NUMERICO.sub(" ", texto).split()
+    return all(p in _PALAVRAS_ESCOLHA or p in _ORDINAIS or p in _DIAS_SEMANA for p in resto)
+
+
+def _ordinal_ou_dia_ambiguo(palavras: List[str], texto: str) -> bool:
+    """"segunda"/"quarta"/"quinta" soltos podem ser dia da semana ou posição na lista."""
+    if not _DIAS_AMBIGUOS & set(palavras):
+        return False
+    sem_dias = re.sub(r"\b\w+\s+feira\b", " ", texto)
+    if not _DIAS_AMBIGUOS & set(sem_dias.split()):
+        return False
+    return not re.search(r"\b(?:opcao|alternativa|horario)\b", sem_dias)
+
+
+def _extrair_ordinal(texto: str) -> Optional[int]:
+    sem_dias = re.sub(r"\b\w+\s+feira\b", " ", texto)
+    for palavra in sem_dias.split():
+        if palavra in _ORDINAIS:
+            return _ORDINAIS[palavra]
+    m = _RE_OPCAO_NUM.search(sem_dias)
+    if m:
+        return int(m.group(1) or m.group(2)) - 1
+    if re.fullmatch(r"\d", sem_dias):
+        return int(sem_dias) - 1
+    return None
+
+
+def _extrair_hora(texto: str):
+    m = _RE_HORA.search(texto)
+    if m:
+        return int(m.group(1)), int(m.group(2) or m.group(3) or 0)
+    m = _RE_HORA_AS.search(texto)
+    if m:
+        return int(m.group(1)), 0
+    return None
+
+
+def resolver_escolha(texto: str, slots: List[dict], agora: datetime = None) -> Optional[dict]:
+    """Retorna o slot escolhido se a resposta identificar exatamente um; senão None."""
+    if not slots or not texto or "?" in texto:
+        return None
+    normalizado = _normalizar(texto)
+    palavras = normalizado.split()
+    if not palavras or len(palavras) > _MAX_PALAVRAS or _NEGACOES & set(palavras):
+        return None
+    if not _so_escolha(normalizado) or _ordinal_ou_dia_ambiguo(palavras, normalizado):
+        return None
+
+    candidatos = [(s, datetime.fromisoformat(s["iso"])) for s in slots]
+    criterio = False
+
+    ordinal = _extrair_ordinal(normalizado)
+    if ordinal is not None:
+        if ordinal >= len(candidatos) or ordinal < -1:
+            return None
+        candidatos = [candidatos[ordinal]]
+        criterio = True
+
+    hora = _extrair_hora(normalizado)
+    if hora is not None:
+        candidatos = [(s, dt) for s, dt in candidatos if (dt.hour, dt.minute) == hora]
+        criterio = True
+
+    dia_semana = _extrair_dia_semana(normalizado)
+    if dia_semana is not None:
+        candidatos = [(s, dt) for s, dt in candidatos if dt.weekday() == dia_semana]
+        criterio = True
+
+    m = _RE_DATA.search(normalizado)
+    if m:
+        dia, mes = int(m.group(1)), int(m.group(2))
+        candidatos = [(s, dt) for s, dt in candidatos if (dt.day, dt.month) == (dia, mes)]
+        criterio = True
+    else:
+        m = _RE_DIA.search(normalizado)
+        if m:
+            candidatos = [(s, dt) for s, dt in candidatos if dt.day == int(m.group(1))]
+            criterio = True
+
+    if "hoje" in palavras or "amanha" in palavras:
+        if candidatos:
+            referencia = agora or datetime.now(candidatos[0][1].tzinfo)
+            alvo = referencia.date() + timedelta(days=1 if "amanha" in palavras else 0)
+            candidatos = [(s, dt) for s, dt in candidatos if dt.date() == alvo]
+        criterio = True
+
+    if criterio and len(candidatos) == 1:
+        return candidatos[0][0]
+    return None
+
+
+class SlotMatcherStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tentativas = 0
+        self.acertos = 0
+        self.chamadas_economizadas = 0
+
+    def registrar(self, acerto: bool, chamadas_economizadas: int = 0):
+        with self._lock:
+            self.tentativas += 1
+            if acerto:
+                self.acertos += 1
+                self.chamadas_economizadas += chamadas_economizadas
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "tentativas": self.tentativas,
+                "acertos": self.acertos,
+                "hit_rate": round(self.acertos / self.tentativas, 4) if self.tentativas else 0.0,
+                "chamadas_gemini_economizadas": self.chamadas_economizadas,
+            }
@@ -0,0 +1,141 @@
+import contextvars
+import inspect
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, List, Optional
+
+from app.services.history import Turn
+from app.services.response_cache import normalizar_prompt
+from app.services.tool_registry import resultado_timeout
+
+logger = logging.getLogger(__name__)
+
+# ============================
+# Execução especulativa de ferramentas
+# ============================
+# Quando o estado da conversa indica que o próximo passo é oferecer horários,
+# a busca de disponibilidade começa em paralelo com a chamada ao Gemini. Se o
+# modelo pedir `oferecer_horarios`, o resultado já está pronto; caso contrário
+# é descartado. Os contadores mostram quantas especulações foram usadas.
+SPECULATION_ENABLED = os.getenv(
+    "SPECULATION_ENABLED", "true").lower() == "true"
+
+# O modelo perguntou se o cliente quer conversar/agendar...
+_CONVITE_AGENDAMENTO = ("conversar com", "agendar", "reuniao", "bate papo", "time comercial",
+                        "time tecnico", "nosso time", "especialista")
+# ... e o cliente confirmou
+_CONFIRMACOES = ("sim", "claro", "pode", "quero", "gostaria", "bora", "vamos", "ok",
+                 "com certeza", "perfeito", "otimo", "pode ser", "aceito")
+# ou o próprio cliente pediu horários
+_PEDIDO_HORARIO = ("horario", "horarios", "agendar", "marcar", "reuniao", "disponibilidade",
+                   "agenda")
+
+
+def proximo_passo_e_agendamento(turns: List[Turn]) -> bool:
+    """Heurística leve: a próxima ferramenta provável é `oferecer_horarios`?"""
+    if not turns or turns[-1].role != "user":
+        return False
+    usuario = normalizar_prompt(" ".join(turns[-1].texts()))
+    palavras = set(usuario.split())
+    if any(p in palavras for p in _PEDIDO_HORARIO):
+        return True
+
+    anterior = next((t for t in reversed(turns[:-1]) if t.role == "model"), None)
+    if anterior is None or anterior.has_function_parts():
+        return False
+    modelo = normalizar_prompt(" ".join(anterior.texts()))
+    convidou = "?" in " ".join(anterior.texts()) and any(
+        c in modelo for c in _CONVITE_AGENDAMENTO)
+    confirmou = any(usuario == c or usuario.startswith(c + " ")
+                    for c in _CONFIRMACOES)
+    return convidou and confirmou
+
+
+class SpeculativePrefetcher:
+    def __init__(self, tool_name: str, tool_func: Callable, timeout: Optional[float] = None,
+                 kwargs_especulativos: Dict[str, Any] = None,
+                 ao_aproveitar: Callable[[Any], None] = None, max_workers: int = 4):
+        """
+        `kwargs_especulativos` vão só na chamada antecipada (ex.: não contar a
+        oferta); `ao_aproveitar` recebe o resultado quando ele é de fato usado.
+        """
+        self.tool_name = tool_name
+        self.tool_func = tool_func
+        self.timeout = timeout
+        self.kwargs_especulativos = kwargs_especulativos or {}
+        self.ao_aproveitar = ao_aproveitar
+        self._padroes = {
+            nome: p.default for nome, p in inspect.signature(tool_func).parameters.items()
+            if p.default is not inspect.Parameter.empty and nome not in (kwargs_especulativos or {})
+        }
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="speculation")
+        self._lock = threading.Lock()
+        self.iniciadas = 0
+        self.aproveitadas = 0
+        self.desperdicadas = 0
+        self.falhas = 0
+
+    def iniciar(self, turns: List[Turn]) -> Optional[Future]:
+        if not SPECULATION_ENABLED or not proximo_passo_e_agendamento(turns):
+            return None
+        with self._lock:
+            self.iniciadas += 1
+        logger.info(f"[ESPECULACAO] Buscando {self.tool_name} em paralelo ao Gemini.")
+        return self._executor.submit(
+            contextvars.copy_context().run, self.tool_func, **self.kwargs_especulativos)
+
+    def _args_compativeis(self, args: dict) -> bool:
+        return all(self._padroes.get(k, object()) == v for k, v in args.items())
+
+    def resolver(self, future: Optional[Future], tool_name: str, args: dict) -> Any:
+        """
+        Retorna o resultado especulado se servir para a chamada pedida pelo modelo;
+        caso contrário descarta a especulação e retorna None.
+        """
+        if future is None:
+            return None
+        if tool_name != self.tool_name or not self._args_compativeis(args):
+            self.descartar(future)
+            return None
+        try:
+            resultado = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # mesmo limite da execução normal; não vale a pena esperar de novo
+            logger.warning(
+                f"[ESPECULACAO] {self.tool_name} excedeu o tempo limite de {self.timeout}s.")
+            future.cancel()
+            with self._lock:
+                self.falhas += 1
+            return resultado_timeout(self.tool_name)
+        except Exception as e:
+            logger.warning(f"[ESPECULACAO] Falha na busca antecipada: {e}")
+            with self._lock:
+                self.falhas += 1
+            return None
+        with self._lock:
+            self.aproveitadas += 1
+        if self.ao_aproveitar is not None:
+            self.ao_aproveitar(resultado)
+        return resultado
+
+    def descartar(self, future: Optional[Future]):
+        if future is None:
+            return
+        future.cancel()
+        with self._lock:
+            self.desperdicadas += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.aproveitadas + self.desperdicadas + self.falhas
+            return {
+                "iniciadas": self.iniciadas,
+                "aproveitadas": self.aproveitadas,
+                "desperdicadas": self.desperdicadas,
+                "falhas": self.falhas,
+                "hit_rate": round(self.aproveitadas / total, 4) if total else 0.0,
+                "waste_rate": round(self.desperdicadas / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,179 @@
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from typing import Annotated, Any, Callable, Dict, Optional, Type
+
+from google.genai import types
+from pydantic import AfterValidator, BaseModel, Field, ValidationError, model_validator
+
+from app.services.admission import AdmissionLimiter, tools_limiter
+from app.utils.date_utils import normalizar_data
+
+logger = logging.getLogger(__name__)
+
+# ============================
+# Modelos de argumentos das ferramentas
+# ============================
+# Os argumentos enviados pelo modelo são validados e convertidos aqui, antes
+# de qualquer chamada ao Calendar ou ao Pipefy.
+
+
+# Datas em linguagem natural ou ISO viram ISO 8601 no fuso de São Paulo
+DataNormalizada = Annotated[str, AfterValidator(normalizar_data)]
+
+
+class RegistrarLeadArgs(BaseModel):
+    nome: str = Field(..., min_length=1, description="Nome completo do lead.")
+    email: str = Field(..., pattern=r"^[^@\s]+@[^@\s]+\.[^@\s]+$",
+                       description="E-mail do lead.")
+    empresa: str = Field(..., min_length=1, description="Empresa do lead.")
+    necessidade: str = Field(..., min_length=1,
+                             description="Necessidade/dor principal do lead.")
+    datetime_str: Optional[DataNormalizada] = Field(
+        None, description="Data e hora da reunião, se já agendada.")
+    link_reuniao: Optional[str] = Field(
+        None, description="Link da reunião, se já agendada.")
+    event_id: Optional[str] = Field(
+        None, description="ID do evento no Google Calendar.")
+
+
+class AtualizarCardArgs(BaseModel):
+    card_id: Optional[str] = Field(None, description="ID do card no Pipefy.")
+    link: Optional[str] = Field(None, description="Link da reunião.")
+    datetime_str: Optional[DataNormalizada] = Field(
+        None, description="Data e hora da reunião.")
+    event_id: Optional[str] = Field(
+        None, description="ID do evento no Google Calendar.")
+    email: Optional[str] = Field(
+        None, description="E-mail do lead, usado se card_id não for informado.")
+
+    @model_validator(mode="after")
+    def _card_ou_email(self):
+        if not self.card_id and not self.email:
+            raise ValueError("Informe card_id ou email.")
+        return self
+
+
+class OferecerHorariosArgs(BaseModel):
+    dias: int = Field(7, ge=1, le=30, description="Quantos dias à frente buscar.")
+    qtd: int = Field(3, ge=1, le=10, description="Quantidade de horários a sugerir.")
+    inicio_hora: int = Field(9, ge=0, le=23, description="Hora inicial do expediente.")
+    fim_hora: int = Field(18, ge=1, le=24, description="Hora final do expediente.")
+    duracao_horas: int = Field(1, ge=1, le=8, description="Duração da reunião em horas.")
+    fuso_horario: str = Field("America/Sao_Paulo", description="Fuso horário.")
+
+    @model_validator(mode="after")
+    def _janela_valida(self):
+        if self.fim_hora <= self.inicio_hora:
+            raise ValueError("fim_hora deve ser maior que inicio_hora.")
+        return self
+
+
+class AgendarReuniaoArgs(BaseModel):
+    card_id: str = Field(..., min_length=1,
+                         description="ID do card do lead no Pipefy.")
+    nome_cliente: str = Field(..., min_length=1, description="Nome do cliente.")
+    email: str = Field(..., pattern=r"^[^@\s]+@[^@\s]+\.[^@\s]+$",
+                       description="E-mail do cliente.")
+    start_time_iso: DataNormalizada = Field(
+        ..., description="Data e hora escolhida (ISO 8601, fuso America/Sao_Paulo).")
+
+
+# ============================
+# Registro de ferramentas
+# ============================
+class ToolArgsError(Exception):
+    """Argumentos inválidos para uma ferramenta; nenhuma chamada externa foi feita."""
+
+    def __init__(self, tool_name: str, mensagem: str):
+        super().__init__(f"{tool_name}: {mensagem}")
+        self.tool_name = tool_name
+        self.mensagem = mensagem
+
+    def resultado(self) -> dict:
+        return {"status": "erro", "mensagem": f"Argumentos inválidos: {self.mensagem}"}
+
+
+def resultado_timeout(name: str) -> dict:
+    return {"status": "erro", "mensagem": f"A operação {name} demorou demais para responder. Tente novamente."}
+
+
+class ToolSpec:
+    __slots__ = ("name", "func", "args_model", "declaration", "timeout")
+
+    def __init__(self, name: str, func: Callable, args_model: Type[BaseModel], descricao: str, timeout: Optional[float]):
+        self.name = name
+        self.func = func
+        self.args_model = args_model
+        self.timeout = timeout
+        self.declaration = types.FunctionDeclaration(
+            name=name,
+            description=descricao,
+            parameters_json_schema=args_model.model_json_schema(),
+        )
+
+
+class ToolRegistry:
+    """
+    Ferramentas montadas uma vez: schemas prontos, validação e timeout por ferramenta.
+
+    Ferramentas sem timeout rodam na thread de quem chamou. As com timeout
+    passam pelo `limiter` antes de ir para o pool, que tem uma thread por vaga:
+    a tarefa começa a rodar assim que é enviada e o timeout mede só a execução.
+    A vaga só é devolvida quando a tarefa termina, mesmo depois do timeout.
+    """
+
+    def __init__(self, limiter: AdmissionLimiter = tools_limiter):
+        self._specs: Dict[str, ToolSpec] = {}
+        self._limiter = limiter
+        self._executor = ThreadPoolExecutor(
+            max_workers=limiter.max_concorrentes, thread_name_prefix="tool")
+        self.tool: Optional[types.Tool] = None
+
+    def register(self, name: str, func: Callable, args_model: Type[BaseModel], descricao: str, timeout: Optional[float] = 20):
+        """
+        `timeout=None` para ferramentas com efeito colateral (criar card, agendar):
+        elas rodam até o fim na thread de quem chamou, porque responder "tente
+        novamente" enquanto ainda rodam levaria a uma segunda reunião ou card
+        duplicado.
+        """
+        self._specs[name] = ToolSpec(name, func, args_model, descricao, timeout)
+        self.tool = types.Tool(function_declarations=[
+                               s.declaration for s in self._specs.values()])
+
+    def spec(self, name: str) -> ToolSpec:
+        return self._specs[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._specs
+
+    def validar(self, name: str, args: dict) -> dict:
+        """Valida e converte os argumentos; retorna só os campos informados pelo modelo."""
+        spec = self._specs[name]
+        try:
+            modelo = spec.args_model.model_validate(args or {})
+        except ValidationError as e:
+            erros = "; ".join(
+                f"{'.'.join(str(p) for p in err['loc']) or 'args'}: {err['msg']}" for err in e.errors())
+            raise ToolArgsError(name, erros)
+        return modelo.model_dump(exclude_unset=True)
+
+    def executar(self, name: str, args: dict) -> Any:
+        spec = self._specs[name]
+        if spec.timeout is None:
+            return spec.func(**args)
+        self._limiter.adquirir()
+        try:
+            # o contexto acompanha a thread para que o trace do turno registre o I/O
+            future = self._executor.submit(
+                contextvars.copy_context().run, spec.func, **args)
+        except BaseException:
+            self._limiter.liberar()
+            raise
+        future.add_done_callback(lambda _: self._limiter.liberar())
+        try:
+            return future.result(timeout=spec.timeout)
+        except FutureTimeout:
+            logger.warning(
+                f"[TOOLS] {name} excedeu o tempo limite de {spec.timeout}s.")
+            return resultado_timeout(name)
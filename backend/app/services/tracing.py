@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, List, Optional
+
+from google.genai import types
+
+from .history import Turn
+
+logger = logging.getLogger(__name__)
+
+# ============================
+# Gravação de turnos para replay
+# ============================
+# Com TRACE_RECORD=true cada chamada a `run_gemini_agent` vira uma linha JSONL
+# com o histórico recebido, as respostas do modelo, as ferramentas chamadas e
+# as chamadas externas (Calendar/Pipefy) com tempo e resposta. O arquivo é
+# reproduzido offline por `benchmarks/replay.py`. Desligado, o custo é uma
+# consulta a um ContextVar por chamada externa.
+TRACE_RECORD = os.getenv("TRACE_RECORD", "false").lower() == "true"
+TRACE_PATH = os.getenv("TRACE_PATH", "traces/turnos.jsonl")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_VERSION = 2
+
+_turno_atual: ContextVar[Optional["TurnTrace"]] = ContextVar(
+    "trace_turno", default=None)
+
+_RE_OPERACAO_GRAPHQL = re.compile(r"\b(query|mutation)\b[^{]*\{\s*(\w+)")
+
+
+def _ms(inicio: float) -> float:
+    return round((time.perf_counter() - inicio) * 1000, 2)
+
+
+def dump_resposta(response: types.GenerateContentResponse) -> dict:
+    """Resposta do Gemini sem metadados de transporte, reconstruível por model_validate."""
+    return response.model_dump(
+        mode="json", exclude_none=True,
+        exclude={"sdk_http_response", "automatic_function_calling_history"})
+
+
+def texto_da_resposta(response: types.GenerateContentResponse) -> str:
+    if not response.candidates or not response.candidates[0].content:
+        return ""
+    return "".join(p.text or "" for p in response.candidates[0].content.parts or [])
+
+
+def operacao_graphql(query: str) -> str:
+    m = _RE_OPERACAO_GRAPHQL.search(query or "")
+    return f"{m.group(1)}:{m.group(2)}" if m else "graphql"
+
+
+class TurnTrace:
+    __slots__ = ("session_id", "history", "caminho", "sessao", "modelo", "ferramentas",
+                 "io", "resposta", "erro", "inicio", "ts")
+
+    def __init__(self, session_id: Optional[str], history: List[Turn]):
+        self.session_id = session_id
+        self.history = history
+        # quem produziu a resposta: "modelo", "cache" ou "slot_matcher"
+        self.caminho = "modelo"
+        # slots oferecidos e lead lidos da sessão, para o replay recriar o mesmo estado
+        self.sessao: Optional[dict] = None
+        self.modelo: List[dict] = []
+        self.ferramentas: List[dict] = []
+        self.io: List[dict] = []
+        self.resposta: Optional[types.GenerateContentResponse] = None
+        self.erro: Optional[str] = None
+        self.inicio = time.perf_counter()
+        self.ts = time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            "v": TRACE_VERSION,
+            "ts": round(self.ts, 3),
+            "session_id": self.session_id,
+            "ms": _ms(self.inicio),
+            "history": [t.to_dict() for t in self.history],
+            "caminho": self.caminho,
+            "sessao": self.sessao,
+            "modelo": self.modelo,
+            "ferramentas": self.ferramentas,
+            "io": list(self.io),
+            "resposta": texto_da_resposta(self.resposta) if self.resposta is not None else None,
+            "erro": self.erro,
+        }
+
+
+class TraceRecorder:
+    def __init__(self, path: str, ativo: bool, taxa_amostragem: float = 1.0):
+        self.path = path
+        self.ativo = ativo
+        self.taxa_amostragem = taxa_amostragem
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def turno(self, session_id: Optional[str], history: List[Turn]):
+        if not self.ativo or random.random() >= self.taxa_amostragem:
+            yield None
+            return
+        trace = TurnTrace(session_id, history)
+        token = _turno_atual.set(trace)
+        try:
+            yield trace
+        except Exception as e:
+            trace.erro = str(e)
+            raise
+        finally:
+            _turno_atual.reset(token)
+            self._gravar(trace)
+
+    def _gravar(self, trace: TurnTrace):
+        try:
+            linha = json.dumps(trace.to_dict(), ensure_ascii=False,
+                               separators=(",", ":"), default=str) + "\n"
+            with self._lock:
+                diretorio = os.path.dirname(self.path)
+                if diretorio:
+                    os.makedirs(diretorio, exist_ok=True)
+                # um único write em O_APPEND: linhas de workers diferentes não se misturam
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, linha.encode("utf-8"))
+                finally:
+                    os.close(fd)
+        except Exception as e:
+            logger.warning(f"[TRACE] Falha ao gravar turno: {e}")
+
+
+trace_recorder = TraceRecorder(TRACE_PATH, TRACE_RECORD, TRACE_SAMPLE_RATE)
+
+
+# ============================
+# Pontos de registro
+# ============================
+def registrar_modelo(inicio: float, response: types.GenerateContentResponse):
+    trace = _turno_atual.get()
+    if trace is not None:
+        trace.modelo.append({"ms": _ms(inicio), "response": dump_resposta(response)})
+
+
+def registrar_caminho(caminho: str):
+    trace = _turno_atual.get()
+    if trace is not None:
+        trace.caminho = caminho
+
+
+def registrar_sessao(slots: list, lead: dict):
+    trace = _turno_atual.get()
+    if trace is not None:
+        trace.sessao = {"slots": slots, "lead": lead}
+
+
+def registrar_ferramenta(nome: str, args: dict, result: Any, inicio: float, origem: str):
+    trace = _turno_atual.get()
+    if trace is not None:
+        trace.ferramentas.append({"nome": nome, "args": args, "result": result,
+                                  "ms": _ms(inicio), "origem": origem})
+
+
+@contextmanager
+def medir_io(servico: str, operacao: str):
+    """Mede uma chamada externa; o chamador preenche `registro["resposta"]`."""
+    trace = _turno_atual.get()
+    if trace is None:
+        yield None
+        return
+    registro = {"servico": servico, "op": operacao}
+    inicio = time.perf_counter()
+    try:
+        yield registro
+    except Exception as e:
+        registro["erro"] = str(e)
+        raise
+    finally:
+        registro["ms"] = _ms(inicio)
+        trace.io.append(registro)
@@ -1,11 +1,21 @@
 import os
 import json
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
 from tempfile import NamedTemporaryFile
+from google.auth.transport.requests import Request
+from google.oauth2.service_account import Credentials
+
+logger = logging.getLogger(__name__)
+
+
 # =====================================
-# Função auxiliar para criar credenciais temporárias
+# Configuração OAuth do cliente (em memória)
 # =====================================
-def build_credentials_file():
-    creds_dict = {
+def build_client_config() -> dict:
+    return {
         "web": {
             "client_id": os.getenv("GOOGLE_CLIENT_ID"),
             "project_id": os.getenv("GOOGLE_PROJECT_ID", "sdr-agendamento"),
@@ -17,8 +27,108 @@ def build_credentials_file():
         }
     }
 
-    temp_file = NamedTemporaryFile(delete=False, suffix=".json")
-    with open(temp_file.name, "w") as f:
-        json.dump(creds_dict, f)
 
-    return temp_file.name
+# =====================================
+# Função auxiliar para criar credenciais temporárias
+# =====================================
+_credentials_file = None
+_credentials_file_lock = threading.Lock()
+
+
+def _remover_credentials_file():
+    if _credentials_file and os.path.exists(_credentials_file):
+        os.remove(_credentials_file)
+
+
+def build_credentials_file():
+    """
+    Grava a configuração OAuth em um arquivo temporário, uma única vez por
+    processo, e o remove na saída. Prefira build_client_config() quando a
+    API aceitar o dicionário diretamente.
+    """
+    global _credentials_file
+    with _credentials_file_lock:
+        if _credentials_file and os.path.exists(_credentials_file):
+            return _credentials_file
+
+        temp_file = NamedTemporaryFile(delete=False, suffix=".json")
+        with open(temp_file.name, "w") as f:
+            json.dump(build_client_config(), f)
+
+        if _credentials_file is None:
+            atexit.register(_remover_credentials_file)
+        _credentials_file = temp_file.name
+        return _credentials_file
+
+
+# =====================================
+# Service Account com token em cache
+# =====================================
+def load_service_account_credentials(scopes: list) -> Credentials:
+    """Monta as credenciais a partir de GOOGLE_SERVICE_ACCOUNT_KEY, sem tocar no disco."""
+    key_content = os.environ.get("GOOGLE_SERVICE_ACCOUNT_KEY")
+    if not key_content:
+        raise ValueError(
+            "A variável de ambiente GOOGLE_SERVICE_ACCOUNT_KEY não está definida")
+    return Credentials.from_service_account_info(json.loads(key_content), scopes=scopes)
+
+
+class TokenRefresher:
+    """
+    Renova o access token em background antes de expirar, para que nenhuma
+    requisição precise esperar pela emissão do token. As credenciais são
+    compartilhadas entre threads; toda renovação, inclusive a que o cliente
+    HTTP faz sozinho quando o token expira, acontece sob um lock.
+    """
+
+    def __init__(self, credentials: Credentials, margem_segundos: int = 300):
+        self.credentials = credentials
+        self.margem = timedelta(seconds=margem_segundos)
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+        # o transporte chama credentials.refresh() direto; passa pelo lock também
+        self._refresh_original = credentials.refresh
+        credentials.refresh = self._refresh
+
+    def _refresh(self, request):
+        with self._lock:
+            self._refresh_original(request)
+
+    def renovar(self):
+        self.credentials.refresh(Request())
+        logger.info("Token do Google renovado; expira em %s.",
+                    self.credentials.expiry)
+
+    def _segundos_ate_renovar(self) -> float:
+        expiry = self.credentials.expiry
+        if expiry is None:
+            return 0
+        # google-auth guarda expiry como datetime UTC sem tzinfo
+        return max((expiry - self.margem - datetime.utcnow()).total_seconds(), 0)
+
+    def _loop(self):
+        while not self._parar.is_set():
+            espera = self._segundos_ate_renovar()
+            if espera > 0:
+                self._parar.wait(espera)
+                continue
+            try:
+                self.renovar()
+            except Exception as e:
+                logger.warning("Falha ao renovar token do Google: %s", e)
+                self._parar.wait(30)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        try:
+            self.renovar()
+        except Exception as e:
+            logger.warning("Falha ao obter token inicial do Google: %s", e)
+        self._thread = threading.Thread(
+            target=self._loop, name="google-token-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._parar.set()
@@ -0,0 +1,72 @@
+"""
+Microbenchmark da conversão de histórico para types.Content.
+
+Compara o caminho antigo (pydantic -> dict -> dict preparado -> Content,
+reconstruído a cada turno) com a representação compacta em Turn e o
+Content memoizado, para históricos de 50 a 200 turnos.
+
+Uso (a partir de backend/):
+    python -m benchmarks.bench_history
+"""
+import timeit
+from typing import List
+
+from google.genai import types
+
+from app.models import HistoryItem, HistoryPart
+from app.services.history import clear_content_cache, to_contents, to_turns
+
+
+def _gerar_historico(n_turnos: int) -> List[HistoryItem]:
+    history = []
+    for i in range(n_turnos):
+        if i % 10 == 5:
+            history.append(HistoryItem(role="model", parts=[HistoryPart(
+                function_call={"name": "oferecer_horarios", "args": {}})]))
+        elif i % 10 == 6:
+            history.append(HistoryItem(role="function", parts=[HistoryPart(
+                function_response={"name": "oferecer_horarios", "response": {"horarios": [
+                    {"label": "20/10/2026 09:00", "iso": "2026-10-20T09:00:00-03:00"}]}})]))
+        else:
+            role = "user" if i % 2 == 0 else "model"
+            history.append(HistoryItem(role=role, parts=[HistoryPart(
+                text=f"Mensagem {i} da conversa com algum conteúdo de exemplo.")]))
+    return history
+
+
+def _caminho_antigo(history: List[HistoryItem]) -> List[types.Content]:
+    dicts = [{"role": h.role, "parts": [{"text": p.text} for p in h.parts]}
+             for h in history]
+    prepared = []
+    for item in dicts:
+        role = item["role"] if item["role"] in ("user", "model") else "model"
+        parts = [{"text": p["text"]} for p in item["parts"] if p.get("text")]
+        prepared.append({"role": role, "parts": parts})
+    return [types.Content(role=item["role"], parts=[types.Part(text=p["text"]) for p in item["parts"]])
+            for item in prepared]
+
+
+def _caminho_novo_frio(history: List[HistoryItem]) -> List[types.Content]:
+    clear_content_cache()
+    return to_contents(to_turns(history))
+
+
+def _caminho_novo(history: List[HistoryItem]) -> List[types.Content]:
+    return to_contents(to_turns(history))
+
+
+def main():
+    repeticoes = 50
+    print(f"{'turnos':>7} {'antigo (ms)':>12} {'novo frio (ms)':>15} {'novo memo (ms)':>15}")
+    for n in (50, 100, 200):
+        history = _gerar_historico(n)
+        _caminho_novo(history)  # aquece o cache de Content
+        tempos = [
+            min(timeit.repeat(lambda: f(history), number=repeticoes, repeat=5)) / repeticoes * 1000
+            for f in (_caminho_antigo, _caminho_novo_frio, _caminho_novo)
+        ]
+        print(f"{n:>7} {tempos[0]:>12.3f} {tempos[1]:>15.3f} {tempos[2]:>15.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""
+Replay offline de turnos gravados, com profiling.
+
+Reproduz os turnos gravados com TRACE_RECORD=true chamando `run_gemini_agent`
+de verdade, mas com Gemini, Google Calendar e Pipefy substituídos pelas
+respostas gravadas no trace. Todo o código local (conversão de histórico,
+validação/normalização de argumentos, busca de slots, templates) roda como em
+produção, então o tempo medido é só CPU local.
+
+Uso (a partir de backend/, com o mesmo .env do desenvolvimento):
+    python -m benchmarks.replay traces/turnos.jsonl
+    python -m benchmarks.replay traces/turnos.jsonl --repeticoes 20 --profile replay.prof
+    python -m benchmarks.replay traces/turnos.jsonl --salvar antes.json
+    python -m benchmarks.replay traces/turnos.jsonl --comparar antes.json
+
+Para um profiler por amostragem, rode o replay sob ele:
+    py-spy record -o replay.svg -- python -m benchmarks.replay traces/turnos.jsonl --repeticoes 50
+
+Turnos respondidos pelo cache de respostas são pulados (o cache fica
+desligado no replay). Para os demais, o estado de sessão lido pelo slot
+matcher (horários oferecidos e lead) é recriado a partir do trace, então a
+escolha local reproduz o mesmo caminho sem chamar o modelo.
+
+Com o pré-cálculo de slots ligado, o free/busy só aparece no trace quando a
+tabela foi refeita durante o turno; nos demais, o replay reaproveita a última
+resposta gravada para a mesma operação.
+"""
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import statistics
+import sys
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future
+
+# replay determinístico: sem gravação, especulação, hedge, cache ou espelho
+for _chave, _valor in {
+    "TRACE_RECORD": "false",
+    "SHARED_STATE_BACKEND": "memory",
+    "SPECULATION_ENABLED": "false",
+    "HEDGE_ENABLED": "false",
+    "RESPONSE_CACHE_MAX_TURNS": "0",
+    "PIPEFY_MIRROR_ENABLED": "false",
+    "SLOT_PRECOMPUTE_ENABLED": "false",
+}.items():
+    os.environ.setdefault(_chave, _valor)
+
+from google.genai import types  # noqa: E402
+
+from app.services import calendar_service, gemini_agent, pipefy_service  # noqa: E402
+from app.services.history import clear_content_cache  # noqa: E402
+from app.services.sessions import limpar_slots_ofertados, salvar_lead, salvar_slots_ofertados  # noqa: E402
+from app.services.shared_state import shared_state  # noqa: E402
+from app.services.tracing import operacao_graphql, texto_da_resposta  # noqa: E402
+
+# Funções acompanhadas no relatório (nome da função no pstats)
+FUNCOES_QUENTES = (
+    "run_gemini_agent",
+    "to_turns",
+    "to_contents",
+    "validar",
+    "normalizar_data",
+    "buscar_horarios_disponiveis",
+    "_calcular_slots_livres",
+    "consultar_ocupacao",
+    "resolver_escolha",
+    "formatar_resposta_template",
+)
+
+TOOLS_DEPENDENTES_DE_DATA = {"oferecer_horarios"}
+
+
+class ReplayDivergencia(Exception):
+    """O código pediu uma resposta externa que não está no trace."""
+
+
+# ============================
+# Serviços externos reproduzidos do trace
+# ============================
+class _Gravacoes:
+    def __init__(self, ultimas: dict):
+        self._filas = defaultdict(deque)
+        self._ultimas = ultimas
+
+    def carregar(self, registros):
+        self._filas.clear()
+        for r in registros:
+            self._filas[(r["servico"], r["op"])].append(r.get("resposta"))
+
+    def proxima(self, servico: str, op: str):
+        fila = self._filas.get((servico, op))
+        if fila:
+            return fila.popleft()
+        if (servico, op) in self._ultimas:
+            return self._ultimas[(servico, op)]
+        raise ReplayDivergencia(f"sem resposta gravada para {servico} {op}")
+
+
+class _ModelosGravados:
+    def __init__(self):
+        self._respostas = deque()
+
+    def carregar(self, chamadas):
+        self._respostas = deque(
+            types.GenerateContentResponse.model_validate(c["response"]) for c in chamadas)
+
+    def generate_content(self, model, contents, config):
+        if not self._respostas:
+            raise ReplayDivergencia("o modelo foi chamado mais vezes que no trace")
+        return self._respostas.popleft()
+
+
+class _ClienteGravado:
+    def __init__(self):
+        self.models = _ModelosGravados()
+
+
+class _ExecutorSincrono:
+    """Roda as ferramentas na thread do replay, onde o cProfile está ativo."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+def _instalar_stubs(traces):
+    ultimas = {}
+    for t in traces:
+        for r in t["io"]:
+            if "resposta" in r:
+                ultimas[(r["servico"], r["op"])] = r["resposta"]
+    gravacoes = _Gravacoes(ultimas)
+    cliente = _ClienteGravado()
+
+    gemini_agent.client = cliente
+    gemini_agent.tool_registry._executor = _ExecutorSincrono()
+    calendar_service._executar = lambda request: gravacoes.proxima(
+        "calendar", getattr(request, "methodId", "desconhecida"))
+    pipefy_service._executar_query = lambda query, variables=None: gravacoes.proxima(
+        "pipefy", operacao_graphql(query))
+    return gravacoes, cliente
+
+
+# ============================
+# Execução
+# ============================
+def carregar_traces(caminho: str) -> list:
+    with open(caminho, encoding="utf-8") as f:
+        return [json.loads(linha) for linha in f if linha.strip()]
+
+
+def _caminho(trace: dict) -> str:
+    if "caminho" in trace:
+        return trace["caminho"]
+    # traces v1: sem chamada ao modelo e sem erro só podia ser cache
+    return "cache" if not trace["modelo"] and trace.get("erro") is None else "modelo"
+
+
+def _recriar_sessao(trace: dict):
+    session_id = trace.get("session_id")
+    if not session_id:
+        return
+    sessao = trace.get("sessao")
+    if sessao is None:
+        limpar_slots_ofertados(session_id)
+        return
+    salvar_slots_ofertados(session_id, sessao["slots"])
+    salvar_lead(session_id, sessao["lead"])
+
+
+def _percentil(valores: list, p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(int(len(ordenados) * p / 100), len(ordenados) - 1)]
+
+
+def reproduzir(traces: list, repeticoes: int, profiler: cProfile.Profile = None) -> dict:
+    gravacoes, cliente = _instalar_stubs(traces)
+    latencias, divergencias, dependentes_de_data, erros = [], 0, 0, 0
+    reproduziveis = [t for t in traces if _caminho(t) != "cache"]
+
+    # rodada 0 confere as respostas e aquece imports/schemas; não entra na medição
+    for rodada in range(repeticoes + 1):
+        shared_state.limpar()
+        clear_content_cache()
+        medir = rodada > 0
+        for trace in reproduziveis:
+            gravacoes.carregar(trace["io"])
+            cliente.models.carregar(trace["modelo"])
+            _recriar_sessao(trace)
+
+            inicio = time.perf_counter()
+            if profiler is not None and medir:
+                profiler.enable()
+            try:
+                response = gemini_agent.run_gemini_agent(
+                    trace["history"], session_id=trace.get("session_id"))
+                texto = texto_da_resposta(response)
+            except Exception as e:
+                texto, erro = None, e
+            else:
+                erro = None
+            finally:
+                if profiler is not None and medir:
+                    profiler.disable()
+            if medir:
+                latencias.append((time.perf_counter() - inicio) * 1000)
+                continue
+
+            if erro is not None and trace.get("erro") is None:
+                erros += 1
+                print(f"[ERRO] sessão {trace.get('session_id')}: {erro}", file=sys.stderr)
+            elif texto != trace.get("resposta"):
+                # horários oferecidos dependem do relógio: divergem entre gravação e replay
+                if any(f["nome"] in TOOLS_DEPENDENTES_DE_DATA for f in trace["ferramentas"]):
+                    dependentes_de_data += 1
+                    continue
+                divergencias += 1
+                print(f"[DIVERGE] sessão {trace.get('session_id')}:\n"
+                      f"  gravado:    {trace.get('resposta')!r}\n"
+                      f"  reproduzido: {texto!r}", file=sys.stderr)
+
+    return {
+        "turnos": len(reproduziveis),
+        "pulados_cache": len(traces) - len(reproduziveis),
+        "caminhos": {c: sum(1 for t in reproduziveis if _caminho(t) == c)
+                     for c in sorted({_caminho(t) for t in reproduziveis})},
+        "repeticoes": repeticoes,
+        "divergencias": divergencias,
+        "divergencias_dependentes_de_data": dependentes_de_data,
+        "erros": erros,
+        "latencia_ms": {
+            "p50": round(statistics.median(latencias), 3) if latencias else 0.0,
+            "p95": round(_percentil(latencias, 95), 3),
+            # por rodada, para comparar execuções com números de repetições diferentes
+            "total": round(sum(latencias) / repeticoes, 3) if repeticoes else 0.0,
+        },
+        "io_gravado_ms": round(sum(r["ms"] for t in reproduziveis for r in t["io"]), 3),
+        "modelo_gravado_ms": round(sum(c["ms"] for t in reproduziveis for c in t["modelo"]), 3),
+    }
+
+
+def resumo_funcoes(profiler: cProfile.Profile, repeticoes: int) -> dict:
+    """Chamadas e tempo acumulado por rodada das FUNCOES_QUENTES."""
+    stats = pstats.Stats(profiler).stats
+    resumo = {}
+    for (_arquivo, _linha, nome), (_cc, chamadas, _tt, cumulativo, _callers) in stats.items():
+        if nome in FUNCOES_QUENTES:
+            atual = resumo.setdefault(nome, {"chamadas": 0, "cum_ms": 0.0})
+            atual["chamadas"] += chamadas / repeticoes
+            atual["cum_ms"] += cumulativo * 1000 / repeticoes
+    return {nome: {"chamadas": round(v["chamadas"], 2), "cum_ms": round(v["cum_ms"], 3)}
+            for nome, v in resumo.items()}
+
+
+def comparar(base: dict, atual: dict):
+    print(f"\n{'métrica':<32} {'base':>12} {'atual':>12} {'delta':>9}")
+    linhas = [(f"latencia {k}", base["latencia_ms"][k], atual["latencia_ms"][k])
+              for k in ("p50", "p95", "total")]
+    for nome in FUNCOES_QUENTES:
+        b = base.get("funcoes", {}).get(nome)
+        a = atual.get("funcoes", {}).get(nome)
+        if b or a:
+            linhas.append((nome, (b or {}).get("cum_ms", 0.0), (a or {}).get("cum_ms", 0.0)))
+    for nome, b, a in linhas:
+        delta = f"{(a - b) / b * 100:+.1f}%" if b else "-"
+        print(f"{nome:<32} {b:>12.3f} {a:>12.3f} {delta:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay offline de turnos gravados.")
+    parser.add_argument("trace", help="arquivo JSONL gravado com TRACE_RECORD=true")
+    parser.add_argument("--repeticoes", type=int, default=1,
+                        help="rodadas medidas, além da rodada de conferência")
+    parser.add_argument("--profile", help="grava o perfil cProfile (.prof) neste caminho")
+    parser.add_argument("--salvar", help="grava o relatório JSON para comparação futura")
+    parser.add_argument("--comparar", help="relatório JSON de uma versão anterior")
+    parser.add_argument("--sem-profiler", action="store_true",
+                        help="mede só a latência (use com profilers externos)")
+    args = parser.parse_args()
+
+    traces = carregar_traces(args.trace)
+    profiler = None if args.sem_profiler else cProfile.Profile()
+    relatorio = reproduzir(traces, args.repeticoes, profiler)
+
+    if profiler is not None:
+        relatorio["funcoes"] = resumo_funcoes(profiler, args.repeticoes)
+        if args.profile:
+            profiler.dump_stats(args.profile)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+
+    print(json.dumps(relatorio, indent=2, ensure_ascii=False))
+    if args.salvar:
+        with open(args.salvar, "w", encoding="utf-8") as f:
+            json.dump(relatorio, f, indent=2, ensure_ascii=False)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(json.load(f), relatorio)
+
+    sys.exit(1 if relatorio["divergencias"] or relatorio["erros"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+import multiprocessing
+import os
+
+# ============================
+# Configuração do gunicorn (modo multi-worker)
+# ============================
+# Uso: gunicorn -c gunicorn.conf.py app.main:app
+# Cada worker é um processo uvicorn independente; caches, sessões e
+# reservas de horário ficam no estado compartilhado (SHARED_STATE_BACKEND).
+bind = f"0.0.0.0:{os.getenv('BACKEND_PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Chamadas ao Gemini podem levar dezenas de segundos com retentativas
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "180"))
+graceful_timeout = 30
+keepalive = 5
+
+# Recicla workers periodicamente para conter crescimento de memória
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = 100
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
@@ -0,0 +1,81 @@
+from datetime import datetime
+
+import pytz
+
+from app.services.slot_matcher import resolver_escolha
+
+TZ = pytz.timezone("America/Sao_Paulo")
+
+# terça 09:00, terça 15:00, quarta 10:00
+SLOTS = [
+    {"label": "06/01/2026 09:00", "iso": "2026-01-06T09:00:00-03:00"},
+    {"label": "06/01/2026 15:00", "iso": "2026-01-06T15:00:00-03:00"},
+    {"label": "07/01/2026 10:00", "iso": "2026-01-07T10:00:00-03:00"},
+]
+AGORA = TZ.localize(datetime(2026, 1, 5, 12, 0))
+
+
+def _iso(texto):
+    slot = resolver_escolha(texto, SLOTS, agora=AGORA)
+    return slot["iso"] if slot else None
+
+
+def test_hora_unica():
+    assert _iso("pode ser às 15h") == SLOTS[1]["iso"]
+    assert _iso("10:00") == SLOTS[2]["iso"]
+
+
+def test_ordinal_explicito():
+    assert _iso("a segunda opção") == SLOTS[1]["iso"]
+    assert _iso("primeira") == SLOTS[0]["iso"]
+    assert _iso("a última") == SLOTS[2]["iso"]
+    assert _iso("opção 3") == SLOTS[2]["iso"]
+
+
+def test_dia_da_semana_com_hora():
+    assert _iso("terça às 9") == SLOTS[0]["iso"]
+    assert _iso("quarta-feira") == SLOTS[2]["iso"]
+
+
+def test_data_e_amanha():
+    assert _iso("dia 07/01") == SLOTS[2]["iso"]
+    assert _iso("amanhã às 15h") == SLOTS[1]["iso"]
+
+
+def test_dia_ambiguo_vai_para_o_modelo():
+    assert _iso("segunda às 15h") is None
+    assert _iso("pode ser segunda") is None
+    assert _iso("quinta") is None
+    assert _iso("a quarta") is None
+
+
+def test_segunda_feira_sem_slot():
+    assert _iso("segunda-feira às 15h") is None
+
+
+def test_mais_de_um_candidato():
+    assert _iso("terça") is None
+
+
+def test_negacao_pergunta_e_texto_longo():
+    assert _iso("não, às 15h não dá") is None
+    assert _iso("tem às 15h?") is None
+    assert _iso("olha eu acho que talvez possa ser às 15h se der tudo certo aqui") is None
+
+
+def test_sem_slots_ou_sem_criterio():
+    assert resolver_escolha("15h", []) is None
+    assert _iso("ok") is None
+
+
+def test_ordinal_ou_hora_fora_de_uma_escolha():
+    assert _iso("só um segundo") is None
+    assert _iso("primeiro preciso falar com meu sócio") is None
+    assert _iso("ultimo ponto: qual o valor") is None
+    assert _iso("me manda o link às 15h") is None
+
+
+def test_verbos_de_escolha():
+    assert _iso("fico com a primeira") == SLOTS[0]["iso"]
+    assert _iso("quero às 15h30") is None
+    assert _iso("pode ser amanhã às 15h, por favor") == SLOTS[1]["iso"]
@@ -43,6 +43,7 @@ export function AIChatView({ onBack }: AIChatViewProps) {
 
     if (!savedTime || now - Number(savedTime) > SESSION_TIMEOUT) {
       localStorage.removeItem(`chat_${sessionId}`);
+      localStorage.removeItem(`chat_${sessionId}_history_hash`);
       supabase.from("messages").delete().eq("session_id", sessionId);
     }
 
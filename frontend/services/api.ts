@@ -1,9 +1,23 @@
-
 const BACKEND_URL = process.env.NEXT_PUBLIC_BACKEND_URL;
 
 export interface AgentResponse {
     response: string;
-    history: any[];
+    history?: any[];
+    new_turns?: any[];
+    history_hash?: string;
+}
+
+// O backend guarda o histórico da sessão; depois da primeira resposta basta
+// enviar o prompt novo e o hash recebido. Se o hash não bater (409), o
+// histórico completo é reenviado uma única vez.
+const historyHashKey = (sessionId: string) => `chat_${sessionId}_history_hash`;
+
+async function postChat(body: Record<string, unknown>): Promise<Response> {
+    return fetch(`${BACKEND_URL}/chat`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify(body),
+    });
 }
 
 export async function sendMessageToAPI(
@@ -12,15 +26,24 @@ export async function sendMessageToAPI(
     history: any[]
 ): Promise<AgentResponse> {
     console.log("BACKEND_URL", BACKEND_URL);
-    const res = await fetch(`${BACKEND_URL}/chat`, {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ prompt, session_id: sessionId, history }),
-    });
+    const historyHash = localStorage.getItem(historyHashKey(sessionId));
+
+    let res = historyHash
+        ? await postChat({ prompt, session_id: sessionId, history_hash: historyHash })
+        : await postChat({ prompt, session_id: sessionId, history });
+
+    if (res.status === 409) {
+        localStorage.removeItem(historyHashKey(sessionId));
+        res = await postChat({ prompt, session_id: sessionId, history });
+    }
 
     if (!res.ok) {
         throw new Error(`Erro ao chamar a API: ${res.status}`);
     }
 
-    return res.json();
+    const data: AgentResponse = await res.json();
+    if (data.history_hash) {
+        localStorage.setItem(historyHashKey(sessionId), data.history_hash);
+    }
+    return data;
 }
@@ -14,8 +14,14 @@ cd ../backend
 pip install --upgrade pip
 pip install -r requirements.txt
 
-# Rode FastAPI usando Uvicorn na porta fixa 8000
-uvicorn main:app --host 0.0.0.0 --port 8000 &
+# Com WEB_CONCURRENCY > 1 sobe vários workers via gunicorn (estado em SQLite);
+# caso contrário roda FastAPI usando Uvicorn na porta fixa 8000
+if [ "${WEB_CONCURRENCY:-1}" -gt 1 ]; then
+  export SHARED_STATE_BACKEND="${SHARED_STATE_BACKEND:-sqlite}"
+  gunicorn -c gunicorn.conf.py app.main:app &
+else
+  uvicorn main:app --host 0.0.0.0 --port 8000 &
+fi
 BACKEND_PID=$!
 
 # ================= AGUARDAR AMBOS PROCESSOS =================